@@ -0,0 +1,346 @@
+# encoding: utf-8
+# vim: sts=4 sw=4 et ft=python foldmethod=marker
+"""
+Benchmarks for kzrnote on a synthetic note collection
+
+Generates notes in a temporary XDG directory, times the note store,
+titles, search and the D-Bus API (against a private dbus-daemon), and
+prints the results as JSON, so that runs of different versions can be
+compared.
+
+    python benchmark.py --notes 5000 --output results.json
+"""
+
+# Preamble {{{
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import kzrnote
+
+WORDS_ASCII = """
+note meeting shopping list idea project plan draft todo call email
+garden recipe travel book review budget report weekly summary lecture
+question answer kernel python vim window search index cache server
+""".split()
+WORDS_NON_ASCII = """
+café naïve smörgåsbord façade über straße ångström crème brûlée jalapeño
+日本語 ノート 会議 中文 笔记 русский заметка ελληνικά σημείωση 한국어 메모
+""".split()
+
+# }}}
+# Corpus {{{
+def make_words(rand, count, non_ascii):
+    return [rand.choice(WORDS_NON_ASCII if rand.random() < non_ascii
+                        else WORDS_ASCII)
+            for _i in range(count)]
+
+def generate_corpus(options):
+    """
+    Write @options.notes synthetic notes into the notes directory
+
+    Return the list of their titles
+    """
+    rand = random.Random(options.seed)
+    kzrnote.ensuredir(kzrnote.get_notesdir())
+    titles = []
+    now = time.time()
+    for i in range(options.notes):
+        if titles and rand.random() < options.duplicate_titles:
+            title = rand.choice(titles)
+        else:
+            title = " ".join(make_words(rand, rand.randint(1, 6),
+                                        options.non_ascii))
+            title = "%s %d" % (title, i)
+        titles.append(title)
+        size = max(0, int(rand.lognormvariate(0, options.size_spread) *
+                          options.size))
+        lines = [title, ""]
+        length = 0
+        while length < size:
+            line = " ".join(make_words(rand, rand.randint(3, 14),
+                                       options.non_ascii))
+            lines.append(line)
+            length += len(line) + 1
+        filename = kzrnote.get_new_note_name()
+        kzrnote.touch_filename(filename,
+                               kzrnote.tonoteencoding("\n".join(lines), False))
+        ## spread out the modification times
+        mtime = now - (options.notes - i) * 60
+        os.utime(filename, (mtime, mtime))
+    return titles
+
+# }}}
+# Timing {{{
+def time_calls(function, repeat, setup=None):
+    """
+    Call @function @repeat times (after @setup each time)
+
+    Return a dict of timings in seconds
+    """
+    times = []
+    for _i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        "runs": repeat,
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+    }
+
+class ListModel (object):
+    """
+    Stand-in for the Gtk.ListStore of the note list
+    """
+    def __init__(self):
+        self.rows = []
+
+    def clear(self):
+        del self.rows[:]
+
+    def append(self, row):
+        self.rows.append(row)
+        return row
+
+def bench_store(options, titles):
+    """
+    Time the note store in this process
+
+    Return a dict of name -> timings
+    """
+    results = {}
+    instance = kzrnote.MainInstance()
+    instance.setup_basic()
+
+    def forget_listing():
+        instance.invalidate_note_listing()
+    results["get_note_filenames"] = time_calls(instance.get_note_filenames,
+                                                options.repeat, forget_listing)
+
+    def forget_titles():
+        forget_listing()
+        instance.file_names = kzrnote.NoteTitleIndex()
+        instance.catalog = kzrnote.NoteCatalog()
+    model = ListModel()
+    ## what reload_filemodel does, without the main loop
+    def fill_filemodel():
+        instance.fill_filemodel(model, instance.get_note_listing())
+    results["reload_filemodel_cold"] = time_calls(
+            fill_filemodel, options.repeat, forget_titles)
+    def forget_titles_keep_catalog():
+        forget_listing()
+        instance.file_names = kzrnote.NoteTitleIndex()
+    results["reload_filemodel_catalog"] = time_calls(
+            fill_filemodel, options.repeat, forget_titles_keep_catalog)
+
+    rand = random.Random(options.seed)
+    lookups = [rand.choice(titles) for _i in range(options.queries)]
+    lookups += ["no such title %d" % i for i in range(options.queries)]
+    def has_note_by_title():
+        for title in lookups:
+            instance.has_note_by_title(title)
+    results["has_note_by_title"] = time_calls(has_note_by_title, options.repeat)
+
+    def forget_index():
+        instance.search_index = kzrnote.NoteSearchIndex()
+        index_file = instance.search_index.storagefile
+        if os.path.exists(index_file):
+            os.unlink(index_file)
+    results["search_index_build"] = time_calls(instance.get_search_index,
+                                                options.repeat, forget_index)
+    queries = [" ".join(make_words(rand, rand.randint(1, 2), options.non_ascii))
+               for _i in range(options.queries)]
+    def search_index():
+        index = instance.get_search_index()
+        for query in queries:
+            index.search(query)
+    results["search_index"] = time_calls(search_index, options.repeat)
+    def search_ranked():
+        for query in queries:
+            instance.search_notes_ranked(query)
+    results["search_ranked"] = time_calls(search_ranked, options.repeat)
+    def search_matching():
+        for query in queries:
+            instance.search_notes_matching(query, "words", True)
+    results["search_case_sensitive"] = time_calls(search_matching,
+                                                  options.repeat)
+
+    def forget_written_titles():
+        instance.written_titles = None
+        for name in (kzrnote.CACHE_NOTETITLES, kzrnote.CACHE_TITLEPATTERNS):
+            try:
+                os.unlink(os.path.join(kzrnote.get_cache_dir(), name))
+            except FileNotFoundError:
+                pass
+    def after_note_title_updated():
+        instance.after_note_title_updated()
+        ## the files are written in the background, in order
+        instance.io_pool.submit_write(lambda: None).result()
+    results["after_note_title_updated"] = time_calls(after_note_title_updated,
+                                                      options.repeat,
+                                                      forget_written_titles)
+    instance.io_pool.shutdown()
+    instance.search_index.save()
+    instance.catalog.save()
+    instance.unregister()
+    return results
+
+# }}}
+# D-Bus {{{
+def start_bus():
+    """
+    Start a private dbus-daemon
+
+    Return its process and address
+    """
+    daemon = subprocess.Popen(["dbus-daemon", "--session", "--nofork",
+                               "--print-address=1"],
+                              stdout=subprocess.PIPE,
+                              universal_newlines=True)
+    address = daemon.stdout.readline().strip()
+    if not address:
+        raise RuntimeError("dbus-daemon did not start")
+    return daemon, address
+
+def start_service():
+    """
+    Start kzrnote --headless in a child process on the private bus
+    """
+    return subprocess.Popen([sys.executable, kzrnote.__file__, "--headless"])
+
+def bench_dbus(options):
+    """
+    Time D-Bus calls to a kzrnote service in another process
+
+    Return a dict of name -> timings
+    """
+    import dbus
+    bus = dbus.SessionBus()
+    start = time.perf_counter()
+    while not bus.name_has_owner(kzrnote.server_name):
+        if time.perf_counter() - start > options.timeout:
+            raise RuntimeError("kzrnote service did not start")
+        time.sleep(0.01)
+    startup = time.perf_counter() - start
+    proxy = bus.get_object(kzrnote.server_name, kzrnote.object_name)
+    iface = dbus.Interface(proxy, kzrnote.interface_name)
+
+    results = {}
+    results["service_startup"] = {"runs": 1, "min": startup,
+                                  "median": startup, "max": startup}
+    results["first_call"] = time_calls(iface.Version, 1)
+    results["dbus_Version"] = time_calls(iface.Version, options.repeat)
+    results["dbus_ListAllNotes"] = time_calls(iface.ListAllNotes,
+                                              options.repeat)
+    results["dbus_ListAllNotesWithMetadata"] = time_calls(
+            iface.ListAllNotesWithMetadata, options.repeat)
+    uris = [str(uri) for uri in iface.ListAllNotes()]
+    results["dbus_GetNoteContents"] = time_calls(
+            lambda: iface.GetNoteContents(uris[0]), options.repeat)
+    results["dbus_GetNoteContentsMany"] = time_calls(
+            lambda: iface.GetNoteContentsMany(uris[:100]), options.repeat)
+    rand = random.Random(options.seed)
+    queries = [" ".join(make_words(rand, rand.randint(1, 2), options.non_ascii))
+               for _i in range(options.queries)]
+    def search_notes():
+        for query in queries:
+            iface.SearchNotes(query, False)
+    results["dbus_SearchNotes"] = time_calls(search_notes, options.repeat)
+    def find_note():
+        for query in queries:
+            iface.FindNote(query)
+    results["dbus_FindNote"] = time_calls(find_note, options.repeat)
+    results["service_stats"] = dict((str(name), [int(c), float(t), float(m)])
+            for name, (c, t, m) in iface.KzrnoteStats()[0].items())
+    return results
+
+# }}}
+# main {{{
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--notes", type=int, default=1000,
+                        help="number of notes to generate")
+    parser.add_argument("--size", type=int, default=2000,
+                        help="median note size in characters")
+    parser.add_argument("--size-spread", type=float, default=1.0,
+                        help="spread of note sizes (log-normal sigma)")
+    parser.add_argument("--duplicate-titles", type=float, default=0.05,
+                        help="fraction of notes reusing another note's title")
+    parser.add_argument("--non-ascii", type=float, default=0.2,
+                        help="fraction of non-ASCII words")
+    parser.add_argument("--queries", type=int, default=100,
+                        help="number of queries per search benchmark")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds to wait for the service to start")
+    parser.add_argument("--no-dbus", action="store_true",
+                        help="skip the D-Bus benchmarks")
+    parser.add_argument("--output", help="file to write the results to")
+    return parser.parse_args(argv)
+
+def main(argv):
+    options = parse_args(argv[1:])
+    kzrnote.setup_locale()
+    kzrnote.debug = False
+    kzrnote.lazy_import("uuid")
+    kzrnote.lazy_import("Gio", "gi.repository.Gio")
+    if options.non_ascii and kzrnote.get_note_encoding().lower().replace("-", "") != "utf8":
+        kzrnote.error("Note encoding is %s, generating ASCII notes only" %
+                      kzrnote.get_note_encoding())
+        options.non_ascii = 0
+    daemon = service = None
+    bench_dir = tempfile.mkdtemp(prefix="kzrnote-bench-")
+    try:
+        ## everything kzrnote touches is in the temporary directory
+        ## (the kzrnote service started below inherits it)
+        for xdg_var in ("XDG_DATA_HOME", "XDG_CACHE_HOME", "XDG_CONFIG_HOME"):
+            os.environ[xdg_var] = os.path.join(bench_dir, xdg_var.lower())
+        ## also for the store benchmarks, where kzrnote takes its
+        ## name on the session bus
+        daemon, address = start_bus()
+        os.environ["DBUS_SESSION_BUS_ADDRESS"] = address
+        start = time.perf_counter()
+        titles = generate_corpus(options)
+        report = {
+            "kzrnote_version": kzrnote.VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": dict(vars(options)),
+            "corpus_seconds": time.perf_counter() - start,
+            "results": bench_store(options, titles),
+        }
+        if not options.no_dbus:
+            service = start_service()
+            report["results"].update(bench_dbus(options))
+    finally:
+        for process in (service, daemon):
+            if process is not None:
+                process.terminate()
+                process.wait()
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    if options.output:
+        with open(options.output, "w", encoding="utf-8") as outfobj:
+            json.dump(report, outfobj, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
+
+# }}}
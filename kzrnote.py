@@ -7,19 +7,28 @@ ICONNAME = 'kzrnote'
 VERSION='0.2'
 
 # Preamble {{{
+import bisect
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import heapq
 import importlib
+import itertools
 import json
 import locale
+import math
+import mmap
 import os
+import re
 import signal
+import struct
 import sys
+import threading
 import time
 import urllib.parse
-import subprocess
 
 import gi
-gi.require_version("Gtk", "3.0")
-gi.require_version("Vte", "2.91")
 
 import dbus
 from dbus.gi_service import ExportedGObject
@@ -59,6 +68,146 @@ def log(*args):
     sys.stderr.write(str(time.time()) + " ")
     plainlog(*args)
 
+_start_time = time.perf_counter()
+_first_reply_sent = False
+
+class Profiler (object):
+    """
+    Timings of named spans and counts of named events, for the
+    main thread
+
+    Totals are always kept; each single span is only recorded
+    (for a Chrome trace) after start_trace.
+    """
+    def __init__(self):
+        ## name -> [count, total seconds, max seconds]
+        self.spans = {}
+        self.counts = collections.Counter()
+        self.trace = None
+
+    def start_trace(self):
+        self.trace = []
+
+    def add_span(self, name, start, end):
+        """
+        Record span @name from @start to @end (time.perf_counter values)
+        """
+        duration = end - start
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [1, duration, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+        if self.trace is not None:
+            self.trace.append({"name": name, "ph": "X",
+                               "ts": 1e6 * (start - _start_time),
+                               "dur": 1e6 * duration,
+                               "pid": os.getpid(), "tid": 1})
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+        if self.trace is not None:
+            self.trace.append({"name": name, "ph": "C",
+                               "ts": 1e6 * (time.perf_counter() - _start_time),
+                               "pid": os.getpid(),
+                               "args": {name: self.counts[name]}})
+
+    def get_stats(self):
+        """
+        Return a dict of span name -> (count, total seconds, max seconds)
+        and a dict of event name -> count
+        """
+        spans = dict((name, tuple(entry)) for name, entry in self.spans.items())
+        return spans, dict(self.counts)
+
+    def write_summary(self, outfobj):
+        outfobj.write("%-40s %8s %10s %10s\n" %
+                      ("span", "count", "total ms", "max ms"))
+        for name, (count, total, longest) in sorted(self.spans.items(),
+                key=lambda item: -item[1][1]):
+            outfobj.write("%-40s %8d %10.1f %10.1f\n" %
+                          (name, count, 1000 * total, 1000 * longest))
+        for name, count in sorted(self.counts.items()):
+            outfobj.write("%-40s %8d\n" % (name, count))
+
+    def write_trace(self, filename):
+        """
+        Write the recorded spans as a Chrome trace (JSON), which can be
+        loaded in chrome://tracing or Perfetto
+        """
+        with open(filename, "w", encoding="utf-8") as outfobj:
+            json.dump({"traceEvents": self.trace or [],
+                       "displayTimeUnit": "ms"}, outfobj)
+
+profiler = Profiler()
+
+def profile_span(function):
+    """
+    Decorator timing each call of @function as a span of its name
+    """
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.add_span(function.__name__, start, time.perf_counter())
+    return wrapper
+
+def _log_first_reply(method_name):
+    global _first_reply_sent
+    if not _first_reply_sent:
+        _first_reply_sent = True
+        debug_log("First D-Bus reply (%s) %.1f ms after start" %
+                  (method_name, 1000 * (time.perf_counter() - _start_time)))
+
+def measure_reply(function):
+    """
+    Wrap D-Bus method @function (see measure_replies),
+    timing each call until it is replied to as the span
+    "dbus.<method>", and logging the time from start to the first
+    D-Bus reply
+    """
+    name = "dbus." + function.__name__
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        def replied():
+            profiler.add_span(name, start, time.perf_counter())
+            _log_first_reply(function.__name__)
+        reply_handler = kwargs.get("reply_handler")
+        if reply_handler is None:
+            try:
+                return function(*args, **kwargs)
+            finally:
+                replied()
+        error_handler = kwargs["error_handler"]
+        def measured_reply_handler(*reply):
+            replied()
+            return reply_handler(*reply)
+        def measured_error_handler(exc):
+            replied()
+            return error_handler(exc)
+        kwargs["reply_handler"] = measured_reply_handler
+        kwargs["error_handler"] = measured_error_handler
+        try:
+            return function(*args, **kwargs)
+        except BaseException:
+            replied()
+            raise
+    return wrapper
+
+def measure_replies(cls):
+    """
+    Class decorator applying measure_reply to all D-Bus methods of @cls
+    """
+    for name, value in list(vars(cls).items()):
+        if getattr(value, "_dbus_is_method", False):
+            setattr(cls, name, measure_reply(value))
+    return cls
+
 def error(*args):
     sys.stderr.write("Error: ")
     plainlog(*args)
@@ -74,10 +223,57 @@ MAXTITLELEN=50
 WINDOW_SIZE_MAIN = (300, 400)
 NOTE_ICON = "gtk-file"
 N_RECENT_MENU = 15
+## approximate memory limit (bytes) of cached note contents
+CONTENTS_CACHE_SIZE = 32 * 1024 * 1024
+## maximum number of bytes returned by one GetNoteContentsRange
+NOTE_CHUNK_MAX = 4 * 1024 * 1024
+## milliseconds to wait before writing out changed note titles
+TITLES_WRITE_DELAY = 1000
+## milliseconds between recording the geometry of a moving window
+GEOMETRY_UPDATE_DELAY = 250
+## milliseconds to wait before saving changed window geometries
+METADATA_SAVE_DELAY = 5000
+## milliseconds to collect notes directory events before applying them
+MONITOR_BATCH_DELAY = 150
+## detach the note list from its model for batches larger than this
+MONITOR_BATCH_DETACH = 20
+## number of recent changes remembered for GetChangesSince
+CHANGE_LOG_LEN = 1000
+## default number of results for ranked searches
+SEARCH_LIMIT = 50
+## maximum number of indexed words each query word may expand to
+SEARCH_EXPANSION_MAX = 64
+## weight of a full title match relative to the body text score
+SEARCH_TITLE_WEIGHT = 10.0
+## minimum fraction of the query's trigrams a title must contain
+SEARCH_TITLE_MIN = 0.6
+## characters of context on each side of a match in search snippets
+SNIPPET_CONTEXT = 40
+## maximum number of matches reported per note
+SEARCH_MATCHES_MAX = 100
+## number of started Vims kept hidden, ready to open notes in
+PRELOAD_COUNT = 1
+PRELOAD_COUNT_MAX = 8
+## milliseconds to wait before starting Vims for the preload pool
+PRELOAD_DELAY = 500
+## how notes written by kzrnote are synced to disk (see FSYNC_POLICIES)
+FSYNC_POLICY = "data"
+## milliseconds to wait before syncing the notes directory after writes
+DIR_SYNC_DELAY = 1000
+## number of threads reading notes in the background
+IO_WORKERS = 4
 
 DATA_ATTIC="attic"
 CACHE_SWP="cache"
 CACHE_NOTETITLES="notetitles"
+CACHE_TITLEPATTERNS="notetitles.patterns"
+## approximate maximum length of each title pattern line
+TITLE_PATTERN_MAXLEN=8000
+CACHE_SEARCHINDEX="searchindex"
+CACHE_CATALOG="catalog"
+CACHE_METADATA="metadata.records"
+## window geometries in the text format of kzrnote 0.2
+CACHE_METADATA_TEXT="metadata"
 CONFIG_RCTEXT=r"""
 " NOTE: This file is overwritten regularly.
 so ./notemode.vim
@@ -129,12 +325,21 @@ Example::
             "palette": []
         },
         "font": "DejaVu Sans Mono 10",
-        "vim": "vim"
+        "vim": "vim",
+        "preload": 1,
+        "fsync": "data"
     }
 
 Where palette is a list of 8, 16, 232 or 256 colors.
 (Can also be one string with ; separator).
 
+preload is the number of Vim instances that are
+kept started in the background, so that notes open
+faster. Set it to 0 to disable.
+
+fsync is how hard notes written through the D-Bus API
+are synced to disk: "none", "data" or "full".
+
 You can set kzrnote-specific vim settings in the
 file ~/.config/kzrnote/user.vim
 
@@ -251,6 +456,74 @@ def fromnoteencoding(lstr, errors=True):
     """
     return fromlocaleencoding(lstr, errors)
 
+def vim_fnameescape(filename):
+    """
+    Escape @filename for use as argument to a Vim command like :edit
+    (like Vim's fnameescape())
+    """
+    return re.sub(r"""([ \t\n*?[{`$\\%#'"|!<])""", r"\\\1", filename)
+
+def _vim_title_units(title):
+    """
+    Split @title into a list of Vim pattern atoms (lowercased),
+    where any run of whitespace may match across lines
+    """
+    units = []
+    for part in re.split(r"([ \t]+)", title.lower()):
+        if not part:
+            continue
+        if part[0] in " \t":
+            units.append(r"\_s\+")
+        else:
+            units.extend("\\" + c if c in "^$.*~[]\\/" else c for c in part)
+    return units
+
+def _vim_trie_pattern(node):
+    alternatives = [unit + _vim_trie_pattern(child)
+                    for unit, child in sorted(node.items()) if unit]
+    if "" in node:
+        ## a title ends here: the rest is optional, and greedy,
+        ## so that the longest title matches
+        if alternatives:
+            return r"\%(" + r"\|".join(alternatives) + r"\)\="
+        return ""
+    if len(alternatives) == 1:
+        return alternatives[0]
+    return r"\%(" + r"\|".join(alternatives) + r"\)"
+
+def vim_title_patterns(titles):
+    """
+    Return a list of Vim patterns (for case-insensitive, magic matching
+    between / delimiters) that together match any of @titles,
+    preferring the longest title.
+
+    The titles are factored into a prefix trie, and the patterns
+    are split into buckets by first letter.
+    """
+    root = {}
+    for title in titles:
+        node = root
+        for unit in _vim_title_units(title):
+            node = node.setdefault(unit, {})
+        ## the empty unit marks the end of a title
+        node[""] = True
+    patterns = []
+    bucket = []
+    bucket_len = 0
+    for unit, child in sorted(root.items()):
+        if not unit:
+            continue
+        alternative = unit + _vim_trie_pattern(child)
+        if bucket and bucket_len + len(alternative) > TITLE_PATTERN_MAXLEN:
+            patterns.append(r"\|".join(bucket))
+            bucket = []
+            bucket_len = 0
+        bucket.append(alternative)
+        bucket_len += len(alternative) + 2
+    if bucket:
+        patterns.append(r"\|".join(bucket))
+    return patterns
+
 def opennote(filename, mode, **kwargs):
     if 'errors' not in kwargs:
         kwargs['errors'] = "replace"
@@ -302,12 +575,27 @@ def get_filename_for_note_basename(notename):
         return filename
     raise ValueError("No note found")
 
-def get_note_paths():
-    D = get_notesdir()
-    for x in os.listdir(D):
-        path = os.path.join(D, x)
-        if is_note(path):
-            yield path
+def scan_note_entries():
+    """
+    Return a list of (path, stat result) for all notes,
+    most recently changed first.
+
+    Uses only one pass over the notes directory, and one
+    stat call per note.
+    """
+    notes = []
+    with os.scandir(get_notesdir()) as entries:
+        for entry in entries:
+            if (len(entry.name) != FILENAME_LEN or
+                not entry.name.endswith(NOTE_SUFFIX)):
+                continue
+            try:
+                if entry.is_file():
+                    notes.append((entry.path, entry.stat()))
+            except OSError:
+                pass
+    notes.sort(key=lambda note: note[1].st_mtime_ns, reverse=True)
+    return notes
 
 def get_note(note_uuid):
     return os.path.join(get_notesdir(), note_uuid + NOTE_SUFFIX)
@@ -340,31 +628,205 @@ def touch_filename(filename, lcontent=None):
             written += os.write(fd, lcontent[written:])
     os.close(fd)
 
-def overwrite_by_rename(filename, lcontent):
+## fsync policies for overwrite_by_rename
+FSYNC_NONE = "none"
+FSYNC_DATA = "data"
+FSYNC_FULL = "full"
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_DATA, FSYNC_FULL)
+
+_tmp_counter = itertools.count()
+## directories with renamed files, to be synced
+_pending_dir_syncs = set()
+
+def overwrite_by_rename(filename, lcontent, sync=FSYNC_NONE):
     """
     Overwrite @filename by writing to a temporary file,
     then renaming over the original file.
 
     Write the bytestring @lcontent into it
+
+    The temporary file name is unique within the process, and
+    the file keeps the permissions of the file it replaces.
+
+    @sync: one of FSYNC_POLICIES; with FSYNC_DATA or FSYNC_FULL the
+        file is synced (fdatasync or fsync) before the rename, and its
+        directory is queued for sync_pending_directories.
     """
-    tmp_filename = "%s.tmp_%d" % (filename, os.getpid())
-    touch_filename(tmp_filename, lcontent)
+    while True:
+        tmp_filename = "%s.tmp_%d_%d" % (filename, os.getpid(), next(_tmp_counter))
+        try:
+            fd = os.open(tmp_filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        except FileExistsError:
+            continue
+        break
+    try:
+        try:
+            os.fchmod(fd, os.stat(filename).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        lview = memoryview(lcontent)
+        written = 0
+        while written < len(lview):
+            written += os.write(fd, lview[written:])
+        if sync == FSYNC_FULL:
+            os.fsync(fd)
+        elif sync == FSYNC_DATA:
+            getattr(os, "fdatasync", os.fsync)(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_filename)
+        raise
+    os.close(fd)
     os.rename(tmp_filename, filename)
+    if sync != FSYNC_NONE:
+        _pending_dir_syncs.add(os.path.dirname(filename))
+
+def sync_pending_directories():
+    """
+    fsync the directories of files written by overwrite_by_rename,
+    so that the renames are durable.
+
+    Batching this means several writes share one directory sync.
+    """
+    while _pending_dir_syncs:
+        dirname = _pending_dir_syncs.pop()
+        try:
+            fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError as exc:
+            error("When syncing %s:" % dirname, exc)
 
 def read_note_contents(filename):
     """
     Read @filename which must exist
 
-    return a byte string
+    return a unicode string
     """
-    read = []
     with opennote(filename, "r") as fobj:
-        while 1:
-            r = fobj.read()
-            if not r:
+        return fobj.read()
+
+def read_note_range(filename, offset, length):
+    """
+    Read up to @length bytes from byte @offset of @filename
+    which must exist, without reading the rest of the file
+
+    return a byte string (in the note encoding)
+    """
+    with open(filename, "rb") as fobj:
+        size = os.fstat(fobj.fileno()).st_size
+        if offset >= size or length <= 0:
+            return b""
+        with mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[offset:offset + length]
+
+def get_note_encoding():
+    return locale.getpreferredencoding(do_setlocale=False)
+
+def read_note_title(filename):
+    """
+    Return the title of @filename: its first line, or
+    DEFAULT_NOTE_NAME if it is empty or can not be read
+    """
+    try:
+        with opennote(filename, "r") as f:
+            for firstline in f:
+                ufirstline = firstline.strip()
+                if ufirstline:
+                    return ufirstline[:MAXTITLELEN]
+                break
+    except EnvironmentError:
+        pass
+    return DEFAULT_NOTE_NAME
+
+def probe_notes(filenames):
+    """
+    Return a dict of filename -> (stat result, title) for @filenames,
+    with (None, None) for files that do not exist
+    """
+    probed = {}
+    for filename in filenames:
+        try:
+            stat_res = os.stat(filename)
+        except OSError:
+            probed[filename] = (None, None)
+        else:
+            probed[filename] = (stat_res, read_note_title(filename))
+    return probed
+
+def write_cache_file(filename, lcontent):
+    ensuredir(os.path.dirname(filename))
+    overwrite_by_rename(filename, lcontent)
+
+def write_note_titles(titles, written_titles):
+    """
+    Write the sorted list @titles and their Vim patterns to the cache,
+    unless they are what was written last (@written_titles, or None if
+    not known)
+
+    Return @titles
+    """
+    titles_file = os.path.join(get_cache_dir(), CACHE_NOTETITLES)
+    patterns_file = os.path.join(get_cache_dir(), CACHE_TITLEPATTERNS)
+    if written_titles is None and os.path.exists(patterns_file):
+        try:
+            with opennote(titles_file, "r") as fobj:
+                written_titles = fobj.read().splitlines()
+        except OSError:
+            pass
+    if titles == written_titles:
+        return titles
+    debug_log("Writing %d note titles" % len(titles))
+    lcontent = "".join("%s\n" % (title, ) for title in titles)
+    write_cache_file(titles_file, tonoteencoding(lcontent, False))
+    patterns = vim_title_patterns(titles)
+    lcontent = "".join("%s\n" % (pattern, ) for pattern in patterns)
+    write_cache_file(patterns_file, tonoteencoding(lcontent, False))
+    return titles
+
+def move_note_to_attic(filepath):
+    attic_dir = os.path.join(get_notesdir(), DATA_ATTIC)
+    try:
+        os.makedirs(attic_dir)
+    except OSError:
+        pass
+    os.rename(filepath, os.path.join(attic_dir, os.path.basename(filepath)))
+
+def match_notes(listing, candidates, patterns, limit, get_contents):
+    """
+    Return a list of at most @limit (filename, matches, snippet) for
+    the notes in @listing whose contents match all of @patterns
+
+    @candidates: a set of note uuids to look in, or None for all
+    @get_contents: function returning the contents of a note
+    """
+    results = []
+    for filename, stat_res in listing:
+        if limit is not None and len(results) >= limit:
+            break
+        if (candidates is not None and
+            note_uuid_from_filename(filename) not in candidates):
+            continue
+        try:
+            contents = get_contents(filename)
+        except OSError:
+            continue
+        matches = []
+        for pattern in patterns:
+            found = [(m.start(), m.end() - m.start())
+                     for m in itertools.islice(pattern.finditer(contents),
+                                               SEARCH_MATCHES_MAX)]
+            if not found:
                 break
-            read.append(r)
-    return "".join(read)
+            matches.extend(found)
+        else:
+            matches.sort()
+            start, length = matches[0]
+            snippet = make_snippet(contents, start, start + length)
+            results.append((filename, matches[:SEARCH_MATCHES_MAX], snippet))
+    return results
 
 def try_register_pr_pdeathsig():
     """
@@ -387,44 +849,165 @@ def try_register_pr_pdeathsig():
     except (AttributeError, OSError):
         pass
 
-class OnceCallback:
+class IOPool (object):
     """
-    Callback that can be registered many times, but is only actually called
-    once.
+    Run filesystem work in worker threads, and deliver the results
+    in the main loop
+
+    Reads run on up to @workers threads at once; writes run one
+    at a time, in the order they were submitted.
+
+    The functions run must not touch state owned by the main loop.
     """
-    _active_callbacks = {}
-    def __init__(self, name, function):
+    def __init__(self, workers=IO_WORKERS):
+        self.workers = workers
+        self.readers = None
+        self.writer = None
+        ## future -> (on_result, on_error), until the result is delivered
+        self.undelivered = {}
+        self.lock = threading.Lock()
+
+    def submit(self, function, args=(), on_result=None, on_error=None):
         """
-        name of this function invocation - calls are deduplicated by name
+        Call @function(*@args) in a worker thread, then in the main loop
+        call @on_result(result), or @on_error(exception) if it raised
         """
-        self._name = name
-        self._active_callbacks[name] = function
+        if self.readers is None:
+            self.readers = concurrent.futures.ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="%s-io" % APPNAME)
+        return self._submit(self.readers, function, args, on_result, on_error)
 
-    def __call__(self, *args, **kwargs):
-        try:
-            function = self._active_callbacks.pop(self._name)
-        except KeyError:
-            return None
-        return function(*args, **kwargs)
+    def submit_write(self, function, args=(), on_result=None, on_error=None):
+        """
+        Like submit, but runs after all writes submitted before
+        """
+        if self.writer is None:
+            self.writer = concurrent.futures.ThreadPoolExecutor(
+                    1, thread_name_prefix="%s-write" % APPNAME)
+        return self._submit(self.writer, function, args, on_result, on_error)
+
+    def _submit(self, executor, function, args, on_result, on_error):
+        future = executor.submit(function, *args)
+        with self.lock:
+            self.undelivered[future] = (on_result, on_error)
+        future.add_done_callback(
+                lambda future: GLib.idle_add(self._finish, future))
+        return future
+
+    def _finish(self, future):
+        with self.lock:
+            callbacks = self.undelivered.pop(future, None)
+        if callbacks is None:
+            ## already delivered by shutdown
+            return False
+        on_result, on_error = callbacks
+        exc = future.exception()
+        if exc is None and on_result is not None:
+            try:
+                on_result(future.result())
+            except Exception as result_exc:
+                ## e.g. building a D-Bus reply: the caller is still answered
+                exc = result_exc
+        if exc is None:
+            return False
+        if on_error is not None:
+            try:
+                on_error(exc)
+            except Exception as error_exc:
+                error("In background task:", error_exc)
+        else:
+            error("In background task:", exc)
+        return False
+
+    def shutdown(self):
+        """
+        Wait for all submitted work to finish, and deliver
+        the results the main loop has not yet seen
+
+        (so that e.g. D-Bus calls in flight are replied to)
+        """
+        while True:
+            for executor in (self.readers, self.writer):
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            self.readers = self.writer = None
+            with self.lock:
+                pending = list(self.undelivered)
+            if not pending:
+                break
+            ## delivering may submit more work, so go around again
+            for future in pending:
+                self._finish(future)
 
 
 # }}}
 class NoteMetadataService (object):  # {{{
-    def __init__(self):
-        self.storagefile = os.path.join(get_cache_dir(), "metadata")
+    """
+    Window geometries of notes
+
+    They are saved in a record file: a header of magic, version and
+    number of records, then for each note its uuid (16 bytes) and
+    window width, height, x and y (signed 32 bit), all little-endian.
+    """
+    magic = b"KZMD"
+    version = 1
+    header = struct.Struct("<4sHI")
+    record = struct.Struct("<16s4i")
+
+    def __init__(self, io_pool=None):
+        """
+        @io_pool: if given, periodic saves are written in the background
+        """
+        self.storagefile = os.path.join(get_cache_dir(), CACHE_METADATA)
+        self.io_pool = io_pool
+        ## note uuid -> ((width, height), (x, y))
         self.geometries = {}
+        ## window -> (note filename, timer source)
+        self.pending_windows = {}
+        self.save_source = None
+        self.dirty = False
 
     def load(self):
         """
         Load configuration
         """
         try:
-            with open(self.storagefile, 'r') as fobj:
+            with open(self.storagefile, "rb") as fobj:
+                data = fobj.read()
+        except FileNotFoundError:
+            self.load_text()
+            return
+        except OSError as exc:
+            error("When reading metadata:", exc)
+            return
+        try:
+            magic, version, count = self.header.unpack_from(data)
+        except struct.error:
+            magic = version = None
+        if magic != self.magic or version != self.version:
+            error("Unknown metadata format in", self.storagefile)
+            return
+        end = self.header.size + count * self.record.size
+        if len(data) < end:
+            error("Truncated metadata in", self.storagefile)
+            return
+        records = memoryview(data)[self.header.size:end]
+        for luuid, width, height, x, y in self.record.iter_unpack(records):
+            note_uuid = self.uuid_from_bytes(luuid)
+            self.geometries[note_uuid] = ((width, height), (x, y))
+
+    def load_text(self):
+        """
+        Load geometries saved in the old text format, one line
+        per note with its uri, size and position
+        """
+        try:
+            with open(os.path.join(get_cache_dir(), CACHE_METADATA_TEXT), 'r') as fobj:
                 for line in fobj:
                     parts = line.split()
                     if len(parts) != 5:
                         continue
-                    uri = parts[0]
+                    note_uuid = parts[0].rpartition("/")[2]
                     try:
                         coords = [abs(int(x)) for x in parts[1:]]
                     except ValueError:
@@ -432,32 +1015,101 @@ class NoteMetadataService (object):  # {{{
                     else:
                         (a,b) = coords[:2]
                         (c,d) = coords[2:]
-                        self.geometries[uri] = ((a,b), (c,d))
-        except FileNotFoundError:
-            pass
+                        self.geometries[note_uuid] = ((a,b), (c,d))
+        except (OSError, UnicodeDecodeError):
+            return
+        self.dirty = bool(self.geometries)
+
+    @staticmethod
+    def uuid_from_bytes(luuid):
+        h = luuid.hex()
+        return "%s-%s-%s-%s-%s" % (h[:8], h[8:12], h[12:16], h[16:20], h[20:])
+
+    def dump(self):
+        """
+        Return the geometries in the record format
+        """
+        records = []
+        for note_uuid, ((a,b), (c,d)) in self.geometries.items():
+            try:
+                luuid = bytes.fromhex(note_uuid.replace("-", ""))
+                records.append(self.record.pack(luuid, a, b, c, d))
+            except (ValueError, struct.error) as exc:
+                error("Not saving geometry of note %r:" % note_uuid, exc)
+                continue
+        return (self.header.pack(self.magic, self.version, len(records)) +
+                b"".join(records))
 
     def save(self):
         """
-        Save configuration
+        Save configuration now, if it changed
         """
-        with open(self.storagefile, 'w') as outfobj:
-            for uri, geometry in self.geometries.items():
-                outfobj.write("%s " % uri)
-                ((a,b), (c,d)) = geometry
-                outfobj.write("%d %d %d %d" % (a,b,c,d))
-                outfobj.write("\n")
+        for window in list(self.pending_windows):
+            self.forget_window(window)
+        if self.save_source is not None:
+            GLib.source_remove(self.save_source)
+            self.save_source = None
+        if not self.dirty:
+            return
+        write_cache_file(self.storagefile, self.dump())
+        self.dirty = False
+
+    def schedule_save(self):
+        if self.save_source is None:
+            self.save_source = GLib.timeout_add(METADATA_SAVE_DELAY,
+                                                self.save_in_background)
+
+    def save_in_background(self):
+        self.save_source = None
+        if self.io_pool is None:
+            self.save()
+            return False
+        self.io_pool.submit_write(write_cache_file,
+                                  (self.storagefile, self.dump()))
+        self.dirty = False
+        return False
 
     def update_window_geometry(self, window, event, notefilename):
-        note_uri = get_note_uri(notefilename)
-        self.geometries[note_uri] = (window.get_size(), window.get_position())
+        """
+        Record the geometry of @window for @notefilename; the
+        configure-events of a moving window are coalesced
+        """
+        if window not in self.pending_windows:
+            source = GLib.timeout_add(GEOMETRY_UPDATE_DELAY,
+                                      self.on_geometry_timer, window)
+            self.pending_windows[window] = (notefilename, source)
+        return False
+
+    def on_geometry_timer(self, window):
+        notefilename, _source = self.pending_windows.pop(window)
+        self.record_window_geometry(window, notefilename)
+        return False
+
+    def forget_window(self, window, *args):
+        """
+        Record the pending geometry of @window, if any, and stop
+        following it (when the window is unmapped)
+        """
+        notefilename, source = self.pending_windows.pop(window, (None, None))
+        if notefilename is not None:
+            GLib.source_remove(source)
+            self.record_window_geometry(window, notefilename)
+
+    def record_window_geometry(self, window, notefilename):
+        geometry = (tuple(window.get_size()), tuple(window.get_position()))
+        note_uuid = note_uuid_from_filename(notefilename)
+        if self.geometries.get(note_uuid) != geometry:
+            self.geometries[note_uuid] = geometry
+            self.dirty = True
+            self.schedule_save()
 
     def get_geometry_for(self, notefilename):
         """
         Return a (size, position) tuple for @notefilename
         or None if nothing is recorded.
         """
-        note_uri = get_note_uri(notefilename)
-        return self.geometries.get(note_uri, None)
+        note_uuid = note_uuid_from_filename(notefilename)
+        return self.geometries.get(note_uuid, None)
 
 class Config:
     palette_lengths = (0, 8, 16, 232, 256)
@@ -483,6 +1135,20 @@ class Config:
         else:
             return VIM_DEFAULT
 
+    def get_preload_count(self):
+        count = self.config.get("preload", PRELOAD_COUNT)
+        if isinstance(count, int) and not isinstance(count, bool):
+            return max(0, min(count, PRELOAD_COUNT_MAX))
+        error("preload must be a number: %r" % (count, ))
+        return PRELOAD_COUNT
+
+    def get_fsync_policy(self):
+        policy = self.config.get("fsync", FSYNC_POLICY)
+        if policy in FSYNC_POLICIES:
+            return policy
+        error("fsync must be one of %r: %r" % (FSYNC_POLICIES, policy))
+        return FSYNC_POLICY
+
     def get_color(self, name):
         fg = self.config.get("colors", {}).get(name)
         if fg is None:
@@ -544,12 +1210,640 @@ def guess_default_window_size(cols=80, rows=60):
         ink_r.height * rows,
     )
 
+# }}}
+# Indexes {{{
+class NoteTitleIndex (object):
+    """
+    Mapping of note filename to title, which can also look up
+    notes by their title, exactly or case-insensitively.
+
+    When several notes have the same title, the note that
+    was added to the index first is found.
+    """
+    def __init__(self):
+        self.titles = {}
+        ## filename -> sequence number of when it was first added
+        self.order = {}
+        ## title -> sorted list of (sequence number, filename)
+        self.exact = {}
+        ## casefolded title -> sorted list of (sequence number, filename)
+        self.folded = {}
+        ## trigram of casefolded title -> set of filenames
+        self.trigrams = {}
+        self.counter = 0
+
+    @staticmethod
+    def title_trigrams(title):
+        """
+        Return the set of trigrams of casefolded @title,
+        with a space in front to mark where it starts
+        """
+        text = " " + title.casefold()
+        return set(text[i:i+3] for i in range(len(text) - 2))
+
+    def __contains__(self, filename):
+        return filename in self.titles
+
+    def __getitem__(self, filename):
+        return self.titles[filename]
+
+    def __setitem__(self, filename, title):
+        old_title = self.titles.get(filename)
+        if old_title == title:
+            return
+        if old_title is not None:
+            self._unlink(filename, old_title)
+        if filename not in self.order:
+            self.counter += 1
+            self.order[filename] = self.counter
+        self.titles[filename] = title
+        key = (self.order[filename], filename)
+        bisect.insort(self.exact.setdefault(title, []), key)
+        bisect.insort(self.folded.setdefault(title.casefold(), []), key)
+        for trigram in self.title_trigrams(title):
+            self.trigrams.setdefault(trigram, set()).add(filename)
+
+    def __delitem__(self, filename):
+        self._unlink(filename, self.titles.pop(filename))
+        del self.order[filename]
+
+    def __iter__(self):
+        return iter(self.titles)
+
+    def __len__(self):
+        return len(self.titles)
+
+    def get(self, filename, default=None):
+        return self.titles.get(filename, default)
+
+    def pop(self, filename, default=None):
+        if filename not in self.titles:
+            return default
+        title = self.titles[filename]
+        del self[filename]
+        return title
+
+    def items(self):
+        return self.titles.items()
+
+    def values(self):
+        return self.titles.values()
+
+    def _unlink(self, filename, title):
+        key = (self.order[filename], filename)
+        for index, title_key in ((self.exact, title),
+                                 (self.folded, title.casefold())):
+            keys = index[title_key]
+            keys.remove(key)
+            if not keys:
+                del index[title_key]
+        for trigram in self.title_trigrams(title):
+            filenames = self.trigrams[trigram]
+            filenames.discard(filename)
+            if not filenames:
+                del self.trigrams[trigram]
+
+    def lookup(self, title, case_sensitive=True):
+        """
+        Return the filename of (the first) note with @title,
+        or None if there is none.
+        """
+        if case_sensitive:
+            keys = self.exact.get(title)
+        else:
+            keys = self.folded.get(title.casefold())
+        if keys:
+            return keys[0][1]
+        return None
+
+    def rank(self, query):
+        """
+        Return a dict of filename -> score for notes whose title
+        matches @query (case-insensitive) at least approximately.
+
+        Titles that contain most trigrams of @query score their
+        fraction of them, titles starting with @query score more,
+        and titles equal to @query the most.
+        """
+        folded = query.strip().casefold()
+        query_trigrams = self.title_trigrams(folded)
+        shared = {}
+        for trigram in query_trigrams:
+            for filename in self.trigrams.get(trigram, ()):
+                shared[filename] = shared.get(filename, 0) + 1
+        scores = {}
+        for filename, n_shared in shared.items():
+            score = n_shared / len(query_trigrams)
+            if score < SEARCH_TITLE_MIN:
+                continue
+            title = self.titles[filename].casefold()
+            if title == folded:
+                score = 1.5
+            elif title.startswith(folded):
+                score = 1.2
+            scores[filename] = score
+        return scores
+
+class NoteCatalog (object):
+    """
+    Titles of all notes, kept on disk between runs
+
+    Each title is recorded with the modification time and size of the
+    note it was read from, and is only used while those still match,
+    so that notes need not be opened to find their titles at startup.
+    """
+    version = 1
+
+    def __init__(self):
+        self.storagefile = os.path.join(get_cache_dir(), CACHE_CATALOG)
+        ## note uuid -> (title, mtime_ns, size)
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        """
+        Load the catalog stored on disk
+        """
+        try:
+            with open(self.storagefile, "r", encoding="utf-8") as fobj:
+                data = json.load(fobj)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            error("When reading catalog:", exc)
+            return
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return
+        try:
+            for note_uuid, (title, mtime, size) in data["notes"].items():
+                self.entries[note_uuid] = (title, mtime, size)
+        except (KeyError, TypeError, ValueError) as exc:
+            error("When reading catalog:", exc)
+            self.entries.clear()
+
+    def save(self, io_pool=None):
+        """
+        Save the catalog if it changed
+
+        @io_pool: if given, write it out in the background
+        """
+        if not self.dirty:
+            return
+        data = {"version": self.version, "notes": self.entries}
+        lcontent = json.dumps(data).encode("utf-8")
+        self.dirty = False
+        if io_pool is None:
+            write_cache_file(self.storagefile, lcontent)
+        else:
+            io_pool.submit_write(write_cache_file, (self.storagefile, lcontent))
+
+    def get_title(self, filename, stat_res=None):
+        """
+        Return the recorded title for @filename if it is still valid,
+        otherwise None.
+
+        @stat_res: stat result for @filename, if already at hand
+        """
+        entry = self.entries.get(note_uuid_from_filename(filename))
+        if entry is None:
+            return None
+        if stat_res is None:
+            try:
+                stat_res = os.stat(filename)
+            except OSError:
+                return None
+        if entry[1:] == (stat_res.st_mtime_ns, stat_res.st_size):
+            return entry[0]
+        return None
+
+    def update(self, filename, title, stat_res):
+        """
+        Record @title for @filename with stat result @stat_res
+        (taken before the title was read)
+        """
+        entry = (title, stat_res.st_mtime_ns, stat_res.st_size)
+        note_uuid = note_uuid_from_filename(filename)
+        if self.entries.get(note_uuid) != entry:
+            self.entries[note_uuid] = entry
+            self.dirty = True
+
+    def remove(self, filename):
+        if self.entries.pop(note_uuid_from_filename(filename), None):
+            self.dirty = True
+
+    def __contains__(self, filename):
+        return note_uuid_from_filename(filename) in self.entries
+
+    def retain(self, filenames):
+        """
+        Forget all notes except @filenames
+        """
+        keep = set(note_uuid_from_filename(f) for f in filenames)
+        for note_uuid in set(self.entries) - keep:
+            del self.entries[note_uuid]
+            self.dirty = True
+
+class NoteContentsCache (object):
+    """
+    Cache of decoded note contents, keyed by path and only valid while
+    the note's modification time and size are unchanged.
+
+    The least recently used notes are evicted when the cached contents
+    take up more than @max_size bytes of memory.
+
+    The cache can be used from worker threads.
+    """
+    def __init__(self, max_size=CONTENTS_CACHE_SIZE):
+        self.lock = threading.RLock()
+        ## path -> (mtime_ns, size, contents, memory size)
+        self.entries = collections.OrderedDict()
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, filename):
+        """
+        Return the contents of @filename
+
+        Raises OSError when @filename can not be read
+        """
+        stat_res = os.stat(filename)
+        contents = self.peek(filename, stat_res)
+        if contents is None:
+            with self.lock:
+                self.misses += 1
+            contents = read_note_contents(filename)
+            self.put(filename, stat_res, contents)
+        return contents
+
+    def peek(self, filename, stat_res):
+        """
+        Return the cached contents of @filename if they are valid
+        for @stat_res, otherwise None
+        """
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry[:2] != (stat_res.st_mtime_ns, stat_res.st_size):
+                return None
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, filename, stat_res, contents):
+        """
+        Cache @contents, read from @filename with stat result @stat_res
+        """
+        memsize = sys.getsizeof(contents)
+        with self.lock:
+            self.invalidate(filename)
+            if memsize > self.max_size // 4:
+                return
+            self.entries[filename] = (stat_res.st_mtime_ns, stat_res.st_size,
+                                      contents, memsize)
+            self.size += memsize
+            while self.size > self.max_size:
+                _filename, entry = self.entries.popitem(last=False)
+                self.size -= entry[3]
+                self.evictions += 1
+
+    def invalidate(self, filename):
+        with self.lock:
+            entry = self.entries.pop(filename, None)
+            if entry is not None:
+                self.size -= entry[3]
+
+    def revalidate(self, filename, stat_res):
+        """
+        Drop @filename if its cached contents are out of date
+
+        @stat_res: current stat result for @filename, None if it
+            does not exist
+        """
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                return
+            if (stat_res is None or
+                entry[:2] != (stat_res.st_mtime_ns, stat_res.st_size)):
+                self.invalidate(filename)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "size": self.size,
+            }
+
+def edit_distance_within_one(a, b):
+    """
+    Return True if @a can be made equal to @b with at most
+    one insertion, deletion, substitution or transposition
+    """
+    if abs(len(a) - len(b)) > 1:
+        return False
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            break
+    else:
+        return True
+    if len(a) == len(b):
+        return (a[i+1:] == b[i+1:] or
+                (a[i+1:i+2] == b[i:i+1] and a[i:i+1] == b[i+1:i+2] and
+                 a[i+2:] == b[i+2:]))
+    if len(a) > len(b):
+        return a[i+1:] == b[i:]
+    return a[i:] == b[i+1:]
+
+class NoteSearchIndex (object):
+    """
+    Inverted index of the words in all notes
+
+    Each note is recorded with the modification time and size it was
+    indexed at, so that unchanged notes are never read again, not even
+    across restarts (the index is kept in the cache directory).
+    """
+    version = 2
+    word_re = re.compile(r"\w+")
+    ## BM25 parameters
+    k1 = 1.2
+    b = 0.75
+    ## ranking weight of query words that are prefixes or misspellings
+    prefix_weight = 0.7
+    fuzzy_weight = 0.5
+
+    def __init__(self):
+        self.storagefile = os.path.join(get_cache_dir(), CACHE_SEARCHINDEX)
+        ## word -> set of note uuids
+        self.postings = {}
+        ## sorted list of all words, for prefix lookups
+        self.vocabulary = []
+        ## note uuid -> (mtime_ns, size, dict of word -> count, length)
+        self.notes = {}
+        ## total number of words in all notes
+        self.total_length = 0
+        self.ready = False
+        self.dirty = False
+
+    @classmethod
+    def tokenize(cls, ustr):
+        return frozenset(cls.word_re.findall(ustr.lower()))
+
+    @classmethod
+    def count_words(cls, ustr):
+        return dict(collections.Counter(cls.word_re.findall(ustr.lower())))
+
+    def load(self):
+        """
+        Load the index stored on disk
+        """
+        try:
+            with open(self.storagefile, "r", encoding="utf-8") as fobj:
+                data = json.load(fobj)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            error("When reading search index:", exc)
+            return
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return
+        try:
+            for note_uuid, (mtime, size, counts) in data["notes"].items():
+                self._add(note_uuid, mtime, size, counts)
+        except (AttributeError, KeyError, TypeError, ValueError) as exc:
+            error("When reading search index:", exc)
+            self.notes.clear()
+            self.postings.clear()
+            self.total_length = 0
+        self.vocabulary = sorted(self.postings)
+
+    def save(self):
+        """
+        Save the index if it changed
+        """
+        if not self.dirty:
+            return
+        notes = {}
+        for note_uuid, (mtime, size, counts, length) in self.notes.items():
+            notes[note_uuid] = [mtime, size, counts]
+        data = {"version": self.version, "notes": notes}
+        ensuredir(get_cache_dir())
+        overwrite_by_rename(self.storagefile, json.dumps(data).encode("utf-8"))
+        self.dirty = False
+
+    def refresh(self, listing):
+        """
+        Bring the index up to date with the notes in @listing,
+        a sequence of (filename, stat result), and forget notes
+        that no longer exist.
+
+        After this, the index is ready and is maintained
+        by calls to update_note and remove_note.
+        """
+        self.ready = True
+        seen = set()
+        nread = 0
+        for filename, stat_res in listing:
+            seen.add(note_uuid_from_filename(filename))
+            nread += self.update_note(filename, stat_res)
+        for note_uuid in set(self.notes) - seen:
+            self._remove(note_uuid)
+        debug_log("Search index refreshed, read %d notes" % nread)
+
+    def update_note(self, filename, stat_res=None):
+        """
+        Index @filename if it changed since it was indexed
+
+        @stat_res: stat result for @filename, if already at hand
+        Return True if the note was read
+        """
+        if not self.ready:
+            return False
+        note_uuid = note_uuid_from_filename(filename)
+        try:
+            if stat_res is None:
+                stat_res = os.stat(filename)
+            mtime, size = stat_res.st_mtime_ns, stat_res.st_size
+            entry = self.notes.get(note_uuid)
+            if entry is not None and entry[:2] == (mtime, size):
+                return False
+            counts = self.count_words(read_note_contents(filename))
+        except OSError:
+            self._remove(note_uuid)
+            return False
+        self._remove(note_uuid)
+        for word in counts:
+            if word not in self.postings:
+                bisect.insort(self.vocabulary, word)
+        self._add(note_uuid, mtime, size, counts)
+        self.dirty = True
+        return True
+
+    def remove_note(self, filename):
+        if self.ready:
+            self._remove(note_uuid_from_filename(filename))
+
+    def _add(self, note_uuid, mtime, size, counts):
+        length = sum(counts.values())
+        self.notes[note_uuid] = (mtime, size, counts, length)
+        self.total_length += length
+        for word in counts:
+            self.postings.setdefault(word, set()).add(note_uuid)
+
+    def _remove(self, note_uuid):
+        entry = self.notes.pop(note_uuid, None)
+        if entry is None:
+            return
+        self.total_length -= entry[3]
+        for word in entry[2]:
+            uuids = self.postings[word]
+            uuids.discard(note_uuid)
+            if not uuids:
+                del self.postings[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+        self.dirty = True
+
+    def words_with_prefix(self, prefix):
+        vocabulary = self.vocabulary
+        for i in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            yield vocabulary[i]
+
+    def words_near(self, term):
+        """
+        Yield indexed words within one edit of @term,
+        that start with the same two letters
+        """
+        for word in self.words_with_prefix(term[:2]):
+            if edit_distance_within_one(term, word):
+                yield word
+
+    def search(self, query):
+        """
+        Return the set of uuids of the notes that contain all words
+        in @query (case-insensitive).
+
+        Query words match any word they are a prefix of.
+        """
+        result = None
+        for term in self.tokenize(query):
+            matches = set()
+            for word in self.words_with_prefix(term):
+                matches.update(self.postings[word])
+            result = matches if result is None else result & matches
+            if not result:
+                break
+        return result or set()
+
+    def rank(self, query):
+        """
+        Return a dict of note uuid -> BM25 score for notes matching
+        any word in @query.
+
+        Query words also match (with less weight) words they are a
+        prefix of, at most SEARCH_EXPANSION_MAX of them, or if there
+        are no such words, words within one edit.
+        """
+        scores = {}
+        if not self.notes:
+            return scores
+        n_notes = len(self.notes)
+        avg_length = max(self.total_length / n_notes, 1)
+        for term in self.tokenize(query):
+            weights = {}
+            for word in itertools.islice(self.words_with_prefix(term),
+                                         SEARCH_EXPANSION_MAX):
+                weights[word] = 1.0 if word == term else self.prefix_weight
+            if not weights and len(term) >= 4:
+                for word in self.words_near(term):
+                    weights[word] = self.fuzzy_weight
+            term_scores = {}
+            for word, weight in weights.items():
+                uuids = self.postings[word]
+                df = len(uuids)
+                idf = math.log(1 + (n_notes - df + 0.5) / (df + 0.5))
+                for note_uuid in uuids:
+                    _mtime, _size, counts, length = self.notes[note_uuid]
+                    tf = counts[word]
+                    norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                    score = weight * idf * tf * (self.k1 + 1) / (tf + norm)
+                    ## count only the best matching word per query word
+                    if score > term_scores.get(note_uuid, 0):
+                        term_scores[note_uuid] = score
+            for note_uuid, score in term_scores.items():
+                scores[note_uuid] = scores.get(note_uuid, 0) + score
+        return scores
+
+def build_search_index(listing):
+    """
+    Return a new NoteSearchIndex, loaded and refreshed with @listing
+
+    (run in the background, see MainInstance.get_search_index_async)
+    """
+    index = NoteSearchIndex()
+    index.load()
+    index.refresh(listing)
+    return index
+
+SEARCH_MODES = ("words", "phrase", "regex")
+
+def compile_search_patterns(query, mode="words", case_sensitive=False):
+    """
+    Return a list of compiled regular expressions that a note's
+    contents must all match to match @query
+
+    @mode: "words": each word in @query must begin a word in the note
+           "phrase": @query must begin at a word in the note,
+                     with any whitespace between its words
+           "regex": @query is a Python regular expression
+
+    Raises ValueError for an invalid mode or regular expression
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError("Unknown search mode %r" % (mode, ))
+    flags = 0 if case_sensitive else re.IGNORECASE
+    if mode == "words":
+        terms = NoteSearchIndex.word_re.findall(query)
+        return [re.compile(r"(?<!\w)" + re.escape(term), flags)
+                for term in terms]
+    elif mode == "phrase":
+        words = query.split()
+        if not words:
+            return []
+        return [re.compile(r"(?<!\w)" + r"\s+".join(map(re.escape, words)),
+                           flags)]
+    else:
+        ## "regex"
+        try:
+            return [re.compile(query, flags | re.MULTILINE)]
+        except re.error as exc:
+            raise ValueError("Invalid regular expression: %s" % exc)
+
+def make_snippet(ustr, start, end):
+    """
+    Return the text around @ustr[@start:@end] on one line
+    """
+    snippet_start = max(0, start - SNIPPET_CONTEXT)
+    snippet_end = min(len(ustr), end + SNIPPET_CONTEXT)
+    snippet = " ".join(ustr[snippet_start:snippet_end].split())
+    if snippet_start > 0:
+        snippet = "\u2026" + snippet
+    if snippet_end < len(ustr):
+        snippet = snippet + "\u2026"
+    return snippet
+
 # }}}
 # MainInstance {{{
 server_name = "io.github.kupferlauncher.%s" % APPNAME
 interface_name = "io.github.kupferlauncher.%s" % APPNAME
 object_name = "/io/github/kupferlauncher/%s" % APPNAME
 
+@measure_replies
 class MainInstance (ExportedGObject):
     __gsignals__ = {
         "note-created": (GObject.SignalFlags.RUN_FIRST, GObject.TYPE_NONE,
@@ -585,21 +1879,82 @@ class MainInstance (ExportedGObject):
         #gobject.GObject.__init__(self)
 
         self.open_files = {}
-        self.file_names = {}
+        self.file_names = NoteTitleIndex()
+        self.note_listing = None
+        self.note_stats = None
+        ## filename -> Gtk.TreeIter in the note model
+        ## (iters of a Gtk.ListStore stay valid as long as the row exists)
+        self.model_rows = {}
+        self.written_titles = None
+        self.titles_write_source = None
+        self.dir_sync_source = None
+        ## filename -> last Gio.FileMonitorEvent, in order of arrival
+        self.pending_note_events = {}
+        self.note_events_source = None
+        self.monitor = None
+        ## preload id -> hidden window with a started Vim
         self.preload_ids = {}
+        ## number of preloaded Vims still starting
+        self.preload_pending = 0
+        self.preload_source = None
+        self.vimrc_file = None
+        ## the main window and its note list are built on first use
         self.window = None
+        self.list_view = None
+        self.list_store = None
+        self.list_store_filled = False
+        self.list_filter = None
+        self.titles_loaded = False
+        ## for each title read in progress, the notes deleted meanwhile
+        self.title_reads = []
+        ## filenames of the notes shown in the list, None for all
+        self.search_results = None
         self.status_icon = None
         self.connect("note-deleted", self.on_note_deleted)
         self.connect("title-updated", self.on_note_title_updated)
         self.connect("note-opened", self.on_note_opened)
-        self.metadata_service = NoteMetadataService()
+        self.connect("note-created", self.on_note_created)
+        self.connect("note-contents-changed", self.on_note_contents_changed)
+        ## sequence number of the last change, and recent changes
+        ## as (sequence number, kind, uri)
+        self.change_seq = 0
+        self.change_log = collections.deque(maxlen=CHANGE_LOG_LEN)
+        self.io_pool = IOPool()
+        self.metadata_service = NoteMetadataService(self.io_pool)
+        self.search_index = NoteSearchIndex()
+        ## (on_result, on_error) waiting for the index being built,
+        ## and the notes that changed meanwhile
+        self.search_index_waiters = []
+        self.search_index_stale = set()
+        self.catalog = NoteCatalog()
+        self.contents_cache = NoteContentsCache()
+        ## bumped when the note listing is invalidated
+        self.listing_generation = 0
+        self.note_events_busy = False
         self.config = Config()
         self.ready_to_display_notes = False
+        ## without Gtk, running @mainloop (see --headless)
+        self.headless = False
+        self.mainloop = None
+
+    def unregister(self):
+        dbus.Bus().release_name(server_name)
+
+    def check_gui(self):
+        """
+        Raises NotImplementedError in headless mode
+        """
+        if self.headless:
+            raise NotImplementedError("Not available in headless mode")
 
-    def unregister(self):
-        dbus.Bus().release_name(server_name)
+    def quit(self):
+        if self.mainloop is not None:
+            self.mainloop.quit()
+        else:
+            Gtk.main_quit()
 
     def wait_for_display_notes(self):
+        self.check_gui()
         debug_log("Wait for display_notes, setup done: %s" % self.ready_to_display_notes)
         while Gtk.events_pending() and not self.ready_to_display_notes:
             Gtk.main_iteration()
@@ -610,32 +1965,35 @@ class MainInstance (ExportedGObject):
     def CreateNote(self):
         new_note = get_new_note_name()
         touch_filename(new_note)
+        self.invalidate_note_listing()
         return get_note_uri(new_note)
 
     @dbus.service.method(interface_name, in_signature="s", out_signature="s")
     def CreateNamedNote(self, title):
         new_note = get_new_note_name()
         touch_filename(new_note, tonoteencoding(title))
+        self.invalidate_note_listing()
         return get_note_uri(new_note)
 
-    @dbus.service.method(interface_name, in_signature="s", out_signature="b")
-    def DeleteNote(self, uri):
+    @dbus.service.method(interface_name, in_signature="s", out_signature="b",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def DeleteNote(self, uri, reply_handler, error_handler):
         """
         Raises ValueError on invalid @uri
         """
         filename = get_filename_for_note_uri(uri)
         if is_note(filename):
-            self.delete_note(filename)
-            return True
+            self.delete_note(filename, reply_handler, error_handler)
         else:
             error("Is not a note", uri)
-            return False
+            reply_handler(False)
 
     @dbus.service.method(interface_name, in_signature="s", out_signature="b")
     def DisplayNote(self, uri):
         """
         Raises ValueError on invalid @uri
         """
+        self.check_gui()
         filename = get_filename_for_note_uri(uri)
         if is_note(filename):
             self.wait_for_display_notes()
@@ -667,12 +2025,61 @@ class MainInstance (ExportedGObject):
         filename = get_filename_for_note_uri(uri)
         return is_note(filename)
 
-    @dbus.service.method(interface_name, in_signature="", out_signature="as")
-    def ListAllNotes(self):
-        all_notes = []
-        for note in self.get_note_filenames(True):
-            all_notes.append(get_note_uri(note))
-        return all_notes
+    @dbus.service.method(interface_name, in_signature="", out_signature="as",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def ListAllNotes(self, reply_handler, error_handler):
+        def reply(listing):
+            reply_handler([get_note_uri(filename) for filename, _s in listing])
+        self.get_note_listing_async(reply, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="", out_signature="a(sst)",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def ListAllNotesWithMetadata(self, reply_handler, error_handler):
+        """
+        Return (uri, title, change date) for all notes, most recent first
+        """
+        def reply(listing):
+            ## notes deleted while the titles were read are left out
+            reply_handler([(get_note_uri(filename),
+                            self.file_names[filename],
+                            int(stat_res.st_mtime))
+                           for filename, stat_res in listing
+                           if filename in self.file_names])
+        def with_listing(listing):
+            self.ensure_note_titles_async(listing, reply, error_handler)
+        self.get_note_listing_async(with_listing, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="as", out_signature="a(st)",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def GetNotesMetadata(self, uris, reply_handler, error_handler):
+        """
+        Return (title, change date) for each of @uris, ("", 0) for
+        invalid or non-existing notes
+        """
+        def reply(entries):
+            metadata = []
+            for filename, stat_res in entries:
+                ## unless deleted while the titles were read
+                if stat_res is not None and filename in self.file_names:
+                    metadata.append((self.file_names[filename],
+                                     int(stat_res.st_mtime)))
+                else:
+                    metadata.append(("", 0))
+            reply_handler(metadata)
+        def with_listing(listing):
+            note_stats = self.get_note_stats(listing)
+            entries = []
+            for uri in uris:
+                try:
+                    filename = get_filename_for_note_uri(uri)
+                except ValueError:
+                    filename = None
+                entries.append((filename, note_stats.get(filename)))
+            existing = [entry for entry in entries if entry[1] is not None]
+            self.ensure_note_titles_async(existing,
+                                          lambda _l: reply(entries),
+                                          error_handler)
+        self.get_note_listing_async(with_listing, error_handler)
 
     @dbus.service.method(interface_name, in_signature="s", out_signature="s")
     def GetNoteTitle(self, uri):
@@ -693,32 +2100,118 @@ class MainInstance (ExportedGObject):
         filename = get_filename_for_note_uri(uri)
         return self.get_note_change_date(filename)
 
-    @dbus.service.method(interface_name, in_signature="s", out_signature="s")
-    def GetNoteContents(self, uri):
+    @dbus.service.method(interface_name, in_signature="s", out_signature="s",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def GetNoteContents(self, uri, reply_handler, error_handler):
         """
         Raises ValueError on invalid @uri
         Raises UnicodeDecodeError on coding error
         """
         filename = get_filename_for_note_uri(uri)
         if is_note(filename):
-            return read_note_contents(filename)
+            self.io_pool.submit(self.contents_cache.get, (filename, ),
+                                reply_handler, error_handler)
         else:
-            return ""
+            reply_handler("")
 
-    @dbus.service.method(interface_name, in_signature="ss", out_signature="b")
-    def SetNoteContents(self, uri, contents):
+    @dbus.service.method(interface_name, in_signature="s", out_signature="ts")
+    def GetNoteContentsInfo(self, uri):
+        """
+        Return the size (bytes) and the encoding of the contents
+        of @uri, for use with GetNoteContentsRange
+
+        Raises ValueError on invalid @uri
+        Raises OSError for internal filesystem error
+        """
+        filename = get_filename_for_note_uri(uri)
+        if not is_note(filename):
+            raise ValueError("No note %s" % uri)
+        return os.stat(filename).st_size, get_note_encoding()
+
+    @dbus.service.method(interface_name, in_signature="stu", out_signature="ay",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def GetNoteContentsRange(self, uri, offset, length, reply_handler,
+                             error_handler):
+        """
+        Return up to @length bytes (at most NOTE_CHUNK_MAX) of the
+        contents of @uri from byte @offset, in the note encoding.
+        An empty result means the end of the note.
+
+        Raises ValueError on invalid @uri
+        Raises OSError for internal filesystem error
+        """
+        filename = get_filename_for_note_uri(uri)
+        if not is_note(filename):
+            raise ValueError("No note %s" % uri)
+        self.io_pool.submit(read_note_range,
+                            (filename, offset, min(length, NOTE_CHUNK_MAX)),
+                            reply_handler, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="as", out_signature="as",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def GetNoteContentsMany(self, uris, reply_handler, error_handler):
+        """
+        Return the contents for each of @uris, "" for invalid
+        or non-existing notes
+
+        Raises UnicodeDecodeError on coding error
+        """
+        def read(filename):
+            try:
+                return self.contents_cache.get(filename)
+            except OSError:
+                ## deleted since it was listed
+                return ""
+        def read_all(filenames):
+            return [read(filename) if filename else ""
+                    for filename in filenames]
+        def with_listing(listing):
+            note_stats = self.get_note_stats(listing)
+            filenames = []
+            for uri in uris:
+                try:
+                    filename = get_filename_for_note_uri(uri)
+                except ValueError:
+                    filename = None
+                filenames.append(filename if filename in note_stats else None)
+            self.io_pool.submit(read_all, (filenames, ),
+                                reply_handler, error_handler)
+        self.get_note_listing_async(with_listing, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="ss", out_signature="b",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def SetNoteContents(self, uri, contents, reply_handler, error_handler):
         """
         Raises ValueError on invalid @uri
         Raises UnicodeEncodeError on coding error
         """
         filename = get_filename_for_note_uri(uri)
-        if is_note(filename):
-            lcontents = tonoteencoding(contents)
-            overwrite_by_rename(filename, lcontents)
-            self.emit("note-contents-changed", filename)
-            return True
-        else:
-            return False
+        if not is_note(filename):
+            reply_handler(False)
+            return
+        lcontents = tonoteencoding(contents)
+        fsync_policy = self.config.get_fsync_policy()
+        def write():
+            if self.note_contents_unchanged(filename, contents, lcontents):
+                return None
+            overwrite_by_rename(filename, lcontents, fsync_policy)
+            return os.stat(filename)
+        def written(stat_res):
+            if stat_res is None:
+                debug_log("Contents unchanged", filename)
+                reply_handler(True)
+                return
+            self.schedule_directory_sync()
+            self.invalidate_note_listing()
+            self.contents_cache.invalidate(filename)
+            ## reading it back would translate newlines
+            if "\r" not in contents:
+                self.contents_cache.put(filename, stat_res, contents)
+            ## the monitor reports the change, like any other write
+            if self.monitor is None:
+                self.emit("note-contents-changed", filename)
+            reply_handler(True)
+        self.io_pool.submit_write(write, (), written, error_handler)
 
     @dbus.service.method(interface_name, in_signature="ss", out_signature="b")
     def SetNoteContentsXml(self, uri, contents):
@@ -726,32 +2219,56 @@ class MainInstance (ExportedGObject):
         # SetNoteCompleteXml
         raise NotImplementedError
 
-    @dbus.service.method(interface_name, in_signature="sb", out_signature="as")
-    def SearchNotes(self, query, case_sensistive):
-        ## NOTE: For "compatibility", we are always case sensistive
-        results = []
-        grep_cmd = ['/bin/grep', '-l', '-i']
-        grep_cmd.extend(['-e', query])
-        grep_cmd.extend(['-r', get_notesdir()])
-        grep_cmd.append('--include=*%s' % NOTE_SUFFIX)
-        grep_cmd.extend(['--exclude-dir=%s' % CACHE_SWP,
-                         '--exclude-dir=%s' % DATA_ATTIC])
-        debug_log(grep_cmd)
-        p = subprocess.Popen(grep_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                             close_fds=True)
-        cin, cout = (p.stdin, p.stdout)
-        cin.close()
-        try:
-            for line in cout:
-                line = fromlocaleencoding(line)
-                debug_log(line)
-                line = line.strip()
-                if is_note(line):
-                    results.append(get_note_uri(line))
-        finally:
-            cout.close()
-        return results
+    @dbus.service.method(interface_name, in_signature="sb", out_signature="as",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def SearchNotes(self, query, case_sensistive, reply_handler, error_handler):
+        if case_sensistive:
+            def reply(results):
+                reply_handler([get_note_uri(filename)
+                               for filename, _m, _s in results])
+            self.search_notes_matching_async(query, "words", True, None,
+                                             reply, error_handler)
+            return
+        def reply(index):
+            reply_handler([get_note_uri(get_note(note_uuid))
+                           for note_uuid in sorted(index.search(query))])
+        self.get_search_index_async(reply, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="ssbu",
+                         out_signature="a(sa(uu)s)", async_callbacks=("reply_handler", "error_handler"))
+    def SearchNotesWithSnippets(self, query, mode, case_sensitive, limit,
+                                reply_handler, error_handler):
+        """
+        Search for @query in the contents of all notes, most recent first
+
+        @mode: "words", "phrase" or "regex"
+        @limit: maximum number of notes, 0 for a default number
 
+        Returns for each matching note (uri, matches, snippet) where
+        matches are (character offset, length) and the snippet is the
+        text around the first match.
+
+        Raises ValueError on invalid @mode or regular expression
+        Raises UnicodeDecodeError on coding error
+        """
+        def reply(results):
+            reply_handler([(get_note_uri(filename), matches, snippet)
+                           for filename, matches, snippet in results])
+        self.search_notes_matching_async(query, mode, case_sensitive,
+                                         limit or SEARCH_LIMIT,
+                                         reply, error_handler)
+
+    @dbus.service.method(interface_name, in_signature="su", out_signature="as",
+                         async_callbacks=("reply_handler", "error_handler"))
+    def SearchNotesRanked(self, query, limit, reply_handler, error_handler):
+        """
+        Return at most @limit (0 for a default number) note uris
+        matching @query in their titles or contents, best match first
+        """
+        def reply(filenames):
+            reply_handler([get_note_uri(filename) for filename in filenames])
+        self.search_notes_ranked_async(query, limit or SEARCH_LIMIT,
+                                       reply, error_handler)
 
     @dbus.service.method(interface_name, in_signature="s", out_signature="as")
     def GetTagsForNote(self, tagname):
@@ -773,18 +2290,78 @@ class MainInstance (ExportedGObject):
         ## FIXME
         return []
 
+    ## Change feed: signals and GetChangesSince
+    @dbus.service.signal(interface_name, signature="s")
+    def NoteAdded(self, uri):
+        pass
+
+    @dbus.service.signal(interface_name, signature="ss")
+    def NoteDeleted(self, uri, title):
+        pass
+
+    @dbus.service.signal(interface_name, signature="s")
+    def NoteSaved(self, uri):
+        pass
+
+    @dbus.service.signal(interface_name, signature="uss")
+    def NoteChanged(self, seq, kind, uri):
+        """
+        Emitted for every change with its sequence number;
+        kind is one of "created", "deleted", "changed", "title"
+        """
+        pass
+
+    @dbus.service.method(interface_name, in_signature="u", out_signature="ua(uss)")
+    def GetChangesSince(self, seq):
+        """
+        Return the current sequence number and the list of
+        changes (seq, kind, uri) after @seq, oldest first.
+
+        Sequence numbers restart with each kzrnote instance.
+        If the changes after @seq are not all remembered, the list
+        has a single change (current seq, "reset", ""), and the
+        client must fetch all notes again.
+        """
+        oldest = self.change_log[0][0] if self.change_log else self.change_seq + 1
+        if seq > self.change_seq or seq + 1 < oldest:
+            return self.change_seq, [(self.change_seq, "reset", "")]
+        changes = [change for change in self.change_log if change[0] > seq]
+        return self.change_seq, changes
+
     @dbus.service.method(interface_name, out_signature="s")
     def Version(self):
         return "%s %s" % (APPNAME, VERSION)
 
     ## Kzrnote-specific D-Bus methods
+    @dbus.service.method(interface_name, in_signature="", out_signature="a{st}")
+    def KzrnoteCacheStats(self):
+        """
+        Return counters of the note contents cache:
+        hits, misses, evictions, entries and size (bytes)
+        """
+        return self.contents_cache.get_stats()
+
+    @dbus.service.method(interface_name, in_signature="",
+                         out_signature="a{s(udd)}a{st}")
+    def KzrnoteStats(self):
+        """
+        Return timings of named spans (see --profile) as span name ->
+        (count, total seconds, max seconds), and counts of named events
+
+        D-Bus methods are timed as "dbus.<method name>".
+        """
+        return profiler.get_stats()
+
     @dbus.service.method(interface_name, in_signature="asss", out_signature="s")
     def KzrnoteCommandline(self, uargv, display, desktop_startup_id):
+        if self.headless:
+            return "kzrnote is running in headless mode"
         return self.handle_commandline(uargv, display, desktop_startup_id)
 
     @dbus.service.method(interface_name, in_signature="ss", out_signature="b")
     def KzrnoteNew(self, argument, sfilename):
         debug_log("KzrnoteNew: %s, %s" % (argument, sfilename))
+        self.check_gui()
         self.create_open_note(None)
         return True
 
@@ -800,6 +2377,7 @@ class MainInstance (ExportedGObject):
     @dbus.service.method(interface_name, in_signature="ss", out_signature="b")
     def KzrnoteOpen(self, argument, sfilename):
         debug_log("KzrnoteOpen: %s, %s" % (argument, sfilename))
+        self.check_gui()
         ## Open note either by note uuid or by title
         try:
             ## make sure the filename is a byte string
@@ -817,59 +2395,88 @@ class MainInstance (ExportedGObject):
 
     @dbus.service.method(interface_name)
     def Quit(self):
-        Gtk.main_quit()
+        self.quit()
 
     # }}}
     # Note Model {{{
     def reload_filemodel(self, model):
+        """
+        Fill @model with all notes, reading the titles that are
+        not in the catalog in the background
+        """
+        self.list_store_filled = False
+        generation = self.listing_generation
+        def with_titles(listing):
+            if generation != self.listing_generation:
+                ## notes changed meanwhile, list them again
+                self.reload_filemodel(model)
+                return
+            self.fill_filemodel(model, listing)
+        def with_listing(listing):
+            self.ensure_note_titles_async(listing, with_titles)
+        self.get_note_listing_async(with_listing)
+
+    @profile_span
+    def fill_filemodel(self, model, listing):
+        """
+        Fill @model with the notes in @listing
+        """
         model.clear()
-        for filename in self.get_note_filenames(True):
-            display_name = self.ensure_note_title(filename)
-            model.append((filename, display_name))
-
-    def model_reassess_file(self, model, filename, addrm=False, change=False):
+        self.model_rows.clear()
+        for filename, stat_res in listing:
+            display_name = self.ensure_note_title(filename, stat_res)
+            self.model_rows[filename] = model.append((filename, display_name))
+        self.list_store_filled = True
+        self.catalog.retain(filename for filename, stat_res in listing)
+        self.catalog.save(self.io_pool)
+
+    def model_reassess_file(self, model, filename, addrm=False, change=False,
+                            probed=None):
         """
         Examine changed @filename and decide
         whether to insert, delete, update it
 
         @addrm: if created/deleted
         @change: if changed
+        @probed: (stat result, title) of @filename if already read,
+            see probe_notes
+
+        @model may be None if the note list is not built yet.
         """
         if not is_valid_note_filename(filename):
             return False
-        ## linear search. Will also hit the most recently
-        ## changed files fast anyway
-        row_filename, row_title = (None, None)
-        existed_before = True
-        rowidx = None
-        for idx, row in enumerate(model):
-            row_filename, row_title = row
-            if row_filename == filename:
-                rowidx = idx
-                break
+        stat_res, title = probed or (None, None)
+        rowiter = self.model_rows.get(filename)
+        if model is None:
+            ## until all titles are loaded, the catalog knows the notes
+            ## listed before (kzrnote forgets the notes it deletes)
+            existed_before = (filename in self.file_names or
+                              (not self.titles_loaded and filename in self.catalog))
+        else:
+            existed_before = rowiter is not None
+        if probed is None:
+            exists_now = is_note(filename)
         else:
-            existed_before = False
-        exists_now = is_note(filename)
+            exists_now = stat_res is not None
         if not existed_before and exists_now:
-            new_title = self.ensure_note_title(filename)
-            model.insert(0, (filename, new_title))
+            new_title = self.ensure_note_title(filename, stat_res, title)
+            if model is not None:
+                self.model_rows[filename] = model.insert(0, (filename, new_title))
             self.emit("note-created", filename)
         elif existed_before and exists_now:
-            self.reload_file_note_title(filename)
+            self.reload_file_note_title(filename, stat_res, title)
             new_title = self.file_names[filename]
-            ## write in new title
-            model[rowidx] = (filename, new_title)
-            ## Move it to the top
-            rowpath = (rowidx, )
-            rowiter = model.get_iter(rowpath)
-            topiter = model.get_iter((0, ))
-            model.move_before(rowiter, topiter)
+            if model is not None:
+                ## write in new title
+                model.set_value(rowiter, 1, new_title)
+                ## Move it to the top (after None means first)
+                model.move_after(rowiter, None)
             self.emit("note-contents-changed", filename)
         elif existed_before and not exists_now:
-            del model[rowidx]
             self.emit("note-deleted", filename, False)
         else:
-            error("File modifed does not exist: %r" % filename)
+            ## e.g. a note deleted from kzrnote, reported by the monitor
+            debug_log("File modifed does not exist: %r" % filename)
 
 
     def get_note_change_date(self, filename):
@@ -887,13 +2494,225 @@ class MainInstance (ExportedGObject):
 
         @date_sort: if True, sort by most recent first
         """
-        filenames = get_note_paths()
-        if date_sort:
-            return sorted(filenames,
-                          key=self.get_note_change_date,
-                          reverse=True)
+        ## the listing is always sorted
+        return [filename for filename, stat_res in self.get_note_listing()]
+
+    def get_note_listing(self):
+        """
+        Return a list of (file path, stat result) for all notes,
+        most recent first.
+
+        The listing is shared by all callers until the notes
+        directory changes.
+        """
+        if self.note_listing is not None:
+            return self.note_listing
+        listing = scan_note_entries()
+        ## we can only know when to drop the listing if we have a monitor
+        if self.monitor is not None:
+            self.note_listing = listing
+        return listing
+
+    def get_note_listing_async(self, on_result, on_error=None):
+        """
+        Call @on_result with the note listing (see get_note_listing),
+        scanning the notes directory in the background if needed
+        """
+        if self.note_listing is not None:
+            on_result(self.note_listing)
+            return
+        generation = self.listing_generation
+        def scanned(listing):
+            ## keep it unless the directory changed during the scan
+            if self.monitor is not None and generation == self.listing_generation:
+                self.note_listing = listing
+            on_result(listing)
+        self.io_pool.submit(scan_note_entries, (), scanned, on_error)
+
+    def get_note_stats(self, listing=None):
+        """
+        Return a dict of file path -> stat result for all notes (those
+        in @listing, if given), shared like the note listing.
+        """
+        if listing is None:
+            listing = self.get_note_listing()
+        if self.note_stats is not None and listing is self.note_listing:
+            return self.note_stats
+        note_stats = dict(listing)
+        if listing is self.note_listing:
+            self.note_stats = note_stats
+        return note_stats
+
+    def invalidate_note_listing(self):
+        self.note_listing = None
+        self.note_stats = None
+        self.listing_generation += 1
+
+    def note_contents_unchanged(self, filename, contents, lcontents):
+        """
+        Return True if note @filename already has the contents
+        @contents, encoded as @lcontents
+
+        Can be called from a worker thread.
+        """
+        try:
+            stat_res = os.stat(filename)
+        except OSError:
+            return False
+        if stat_res.st_size != len(lcontents):
+            return False
+        ## (reading back would translate newlines)
+        cached = self.contents_cache.peek(filename, stat_res)
+        if cached is not None and "\r" not in contents:
+            return cached == contents
+        try:
+            with open(filename, "rb") as fobj:
+                return fobj.read() == lcontents
+        except OSError:
+            return False
+
+    def schedule_directory_sync(self):
+        if self.dir_sync_source is None:
+            self.dir_sync_source = GLib.timeout_add(DIR_SYNC_DELAY,
+                                                    self.sync_directories)
+
+    def sync_directories(self):
+        self.dir_sync_source = None
+        ## after the writes that queued them
+        self.io_pool.submit_write(sync_pending_directories)
+        return False
+
+    @profile_span
+    def get_search_index(self):
+        """
+        Return the full-text search index, bringing it up to date
+        on first use.
+
+        This reads all changed notes; in the main loop, use
+        get_search_index_async.
+        """
+        if not self.search_index.ready:
+            self.search_index.load()
+            self.search_index.refresh(self.get_note_listing())
+        return self.search_index
+
+    def get_search_index_async(self, on_result, on_error=None):
+        """
+        Call @on_result with the full-text search index, once it is
+        built in the background (on first use)
+        """
+        if self.search_index.ready:
+            on_result(self.search_index)
+            return
+        self.search_index_waiters.append((on_result, on_error))
+        if len(self.search_index_waiters) > 1:
+            ## already being built
+            return
+        def built(index):
+            for filename in self.search_index_stale:
+                index.update_note(filename)
+            self.search_index_stale.clear()
+            self.search_index = index
+            waiters, self.search_index_waiters = self.search_index_waiters, []
+            for waiter_result, _waiter_error in waiters:
+                waiter_result(index)
+        def failed(exc):
+            self.search_index_stale.clear()
+            waiters, self.search_index_waiters = self.search_index_waiters, []
+            for _waiter_result, waiter_error in waiters:
+                if waiter_error is not None:
+                    waiter_error(exc)
+                else:
+                    error("When building search index:", exc)
+        def with_listing(listing):
+            self.io_pool.submit(build_search_index, (listing, ), built, failed)
+        self.get_note_listing_async(with_listing, failed)
+
+    def update_search_index(self, filename):
+        """
+        Index @filename again, or forget it if it does not exist anymore
+        """
+        if self.search_index.ready:
+            self.search_index.update_note(filename)
+        elif self.search_index_waiters:
+            self.search_index_stale.add(filename)
+
+    def search_notes_matching(self, query, mode="words", case_sensitive=False,
+                              limit=None):
+        """
+        Return a list of at most @limit (filename, matches, snippet)
+        for notes whose contents match @query, most recent first
+
+        See compile_search_patterns for @mode.
+        """
+        patterns = compile_search_patterns(query, mode, case_sensitive)
+        if not patterns:
+            return []
+        return match_notes(self.get_note_listing(),
+                           self.search_candidates(query, mode),
+                           patterns, limit, self.contents_cache.get)
+
+    def search_notes_matching_async(self, query, mode, case_sensitive, limit,
+                                    on_result, on_error=None):
+        """
+        Like search_notes_matching, but read the notes in the background
+        and call @on_result with the results
+
+        Raises ValueError on invalid @mode or regular expression
+        """
+        patterns = compile_search_patterns(query, mode, case_sensitive)
+        if not patterns:
+            on_result([])
+            return
+        def with_listing(listing, candidates):
+            self.io_pool.submit(match_notes,
+                                (listing, candidates, patterns, limit,
+                                 self.contents_cache.get),
+                                on_result, on_error)
+        def with_index(_index):
+            candidates = self.search_candidates(query, mode)
+            self.get_note_listing_async(
+                    lambda listing: with_listing(listing, candidates),
+                    on_error)
+        if mode == "regex":
+            with_index(None)
         else:
-            return filenames
+            self.get_search_index_async(with_index, on_error)
+
+    def search_candidates(self, query, mode):
+        """
+        Return the set of uuids of notes that can match @query,
+        or None if any note can
+        """
+        if mode == "regex":
+            return None
+        ## the index finds a superset of the matching notes
+        return self.get_search_index().search(query)
+
+    def search_notes_ranked(self, query, limit=SEARCH_LIMIT):
+        """
+        Return a list of at most @limit (None for all) note filenames
+        matching @query in their titles or contents, best match first
+        """
+        scores = {}
+        for filename, score in self.file_names.rank(query).items():
+            scores[filename] = SEARCH_TITLE_WEIGHT * score
+        for note_uuid, score in self.get_search_index().rank(query).items():
+            filename = get_note(note_uuid)
+            scores[filename] = scores.get(filename, 0) + score
+        if limit is None:
+            return sorted(scores, key=scores.get, reverse=True)
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+    def search_notes_ranked_async(self, query, limit, on_result,
+                                  on_error=None):
+        """
+        Like search_notes_ranked, but build the search index
+        in the background and call @on_result with the results
+        """
+        self.get_search_index_async(
+                lambda index: on_result(self.search_notes_ranked(query, limit)),
+                on_error)
 
     def has_note_by_title(self, utitle, case_sensitive=True):
         """
@@ -902,51 +2721,159 @@ class MainInstance (ExportedGObject):
         Titles longer than the max length are truncated(!)
         """
         utitle = utitle[:MAXTITLELEN]
-        for filename, note_title in self.file_names.items():
-            if case_sensitive and note_title == utitle:
-                return filename
-            elif not case_sensitive and note_title.lower() == utitle.lower():
-                return filename
-        return None
-
-    def ensure_note_title(self, filename):
-        """make sure we have a title for @filename, and return it for convenience"""
+        if not self.titles_loaded:
+            for filename, stat_res in self.get_note_listing():
+                self.ensure_note_title(filename, stat_res)
+            self.titles_loaded = True
+        return self.file_names.lookup(utitle, case_sensitive)
+
+    def ensure_note_title(self, filename, stat_res=None, title=None):
+        """make sure we have a title for @filename, and return it for convenience
+
+        The title is taken from the catalog if it is still valid.
+        @stat_res: stat result for @filename, if already at hand
+        @title: title read from @filename, if already at hand
+        """
         if not filename in self.file_names:
-            self.reload_file_note_title(filename)
+            catalog_title = self.catalog.get_title(filename, stat_res)
+            if catalog_title is None:
+                self.reload_file_note_title(filename, stat_res, title)
+            else:
+                self.file_names[filename] = catalog_title
         return self.file_names[filename]
 
-    def reload_file_note_title(self, filename):
-        self.file_names[filename] = self.extract_note_title(filename)
-        self.emit("title-updated", filename, self.file_names[filename])
+    def ensure_note_titles_async(self, listing, on_result, on_error=None):
+        """
+        Make sure we have titles for all notes in @listing (a list of
+        (filename, stat result)), reading those that are not in the
+        catalog in the background, then call @on_result(@listing)
+        """
+        missing = []
+        for filename, stat_res in listing:
+            if filename in self.file_names:
+                continue
+            title = self.catalog.get_title(filename, stat_res)
+            if title is None:
+                missing.append((filename, stat_res))
+            else:
+                self.file_names[filename] = title
+        if not missing:
+            on_result(listing)
+            return
+        ## notes deleted while the titles are read, see on_note_deleted
+        deleted = set()
+        self.title_reads.append(deleted)
+        def read_titles():
+            return [read_note_title(filename) for filename, _s in missing]
+        def titles_read(titles):
+            self.title_reads.remove(deleted)
+            for (filename, stat_res), title in zip(missing, titles):
+                if filename not in self.file_names and filename not in deleted:
+                    self.reload_file_note_title(filename, stat_res, title)
+            on_result(listing)
+        def failed(exc):
+            self.title_reads.remove(deleted)
+            if on_error is not None:
+                on_error(exc)
+            else:
+                error("When reading titles:", exc)
+        self.io_pool.submit(read_titles, (), titles_read, failed)
 
-    def extract_note_title(self, filepath):
-        try:
-            with opennote(filepath, "r") as f:
-                for firstline in f:
-                    ufirstline = firstline.strip()
-                    if ufirstline:
-                        return ufirstline[:MAXTITLELEN]
-                    break
-        except EnvironmentError:
-            pass
-        return DEFAULT_NOTE_NAME
+    def reload_file_note_title(self, filename, stat_res=None, title=None):
+        """
+        @title: title read from @filename after @stat_res was taken,
+            if already at hand
+        """
+        if stat_res is None:
+            try:
+                stat_res = os.stat(filename)
+            except OSError:
+                pass
+        old_title = self.file_names.get(filename)
+        if title is None:
+            title = self.extract_note_title(filename, stat_res)
+        self.file_names[filename] = title
+        if stat_res is not None:
+            self.catalog.update(filename, self.file_names[filename], stat_res)
+        if self.file_names[filename] != old_title:
+            self.emit("title-updated", filename, self.file_names[filename])
+            ## a note's first title is not a change
+            if old_title is not None:
+                self.record_change("title", filename)
+
+    def extract_note_title(self, filepath, stat_res=None):
+        """
+        Return the title of @filepath, using cached contents if
+        they are valid for @stat_res
+        """
+        contents = None
+        if stat_res is not None:
+            contents = self.contents_cache.peek(filepath, stat_res)
+        if contents is not None:
+            ufirstline = contents.partition("\n")[0].strip()
+            if ufirstline:
+                return ufirstline[:MAXTITLELEN]
+            return DEFAULT_NOTE_NAME
+        return read_note_title(filepath)
     # }}}
     # GUI {{{
+    @profile_span
     def setup_basic(self):
         """
         Setup basic data needed for displaying notes
         """
         self.metadata_service.load()
+        self.catalog.load()
         self.config.load()
+        ## monitor first, so that the note listing can be kept
+        gfile = Gio.File.new_for_path(get_notesdir())
+        self.monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        if self.monitor:
+            self.monitor.connect("changed", self.on_notes_monitor_changed)
         self.ready_to_display_notes = True
 
+    def load_note_titles(self):
+        """
+        Make sure we have the titles of all notes, reading
+        them in the background
+        """
+        def loaded(listing):
+            self.titles_loaded = True
+            self.catalog.retain(filename for filename, stat_res in listing)
+            self.catalog.save(self.io_pool)
+            ## titles from the catalog are not reported as updated, and
+            ## notes may have changed while kzrnote was not running
+            self.schedule_titles_write()
+        def with_listing(listing):
+            self.ensure_note_titles_async(listing, loaded)
+        self.get_note_listing_async(with_listing)
+        return False
+
+    @profile_span
     def setup_gui(self):
         # notification icon
         status_icon = Gtk.StatusIcon.new_from_icon_name(ICONNAME)
         status_icon.set_tooltip_text(APPNAME)
         status_icon.set_visible(True)
+        status_icon.connect("activate", self.on_status_icon_clicked)
+        status_icon.connect("popup-menu", self.on_status_icon_menu)
         self.status_icon = status_icon
+        self.do_first_run()
+
+    def present_main_window(self, desktop_startup_id="", timestamp=0):
+        """
+        Show the main window, building it on first use
+        """
+        if self.window is None:
+            self.build_main_window()
+        if timestamp:
+            self.window.set_startup_id(desktop_startup_id)
+            self.window.present_with_time(timestamp)
+        else:
+            self.window.present()
 
+    @profile_span
+    def build_main_window(self):
         # main window with its toolbar and note list
         Gtk.Window.set_default_icon_name(ICONNAME)
         self.window = Gtk.Window.new(Gtk.WindowType.TOPLEVEL)
@@ -954,7 +2881,10 @@ class MainInstance (ExportedGObject):
         self.list_view = Gtk.TreeView.new()
         self.list_store = Gtk.ListStore(GObject.TYPE_STRING,
                                         GObject.TYPE_STRING)
-        self.list_view.set_model(self.list_store)
+        ## the list is filtered by the search entry
+        self.list_filter = self.list_store.filter_new(None)
+        self.list_filter.set_visible_func(self.list_filter_visible)
+        self.list_view.set_model(self.list_filter)
         cell = Gtk.CellRendererText()
         filename_col = Gtk.TreeViewColumn("Note", cell, text=1)
         self.list_view.append_column(filename_col)
@@ -988,42 +2918,82 @@ class MainInstance (ExportedGObject):
         toolbar_append(delete)
         toolbar_append(quit)
         toolbar.show_all()
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.connect("search-changed", self.on_search_changed)
+        self.search_entry.connect("activate", self.on_search_activate)
+        self.search_entry.show()
         scrollwin = Gtk.ScrolledWindow()
         scrollwin.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
         scrollwin.add(self.list_view)
         scrollwin.show()
         vbox = Gtk.VBox()
         vbox.pack_start(toolbar, False, True, 0)
+        vbox.pack_start(self.search_entry, False, True, 0)
         vbox.pack_start(scrollwin, True, True, 0)
         vbox.show()
         self.window.add(vbox)
-        # focus the list so that the user can search immediately
-        self.list_view.grab_focus()
+        # focus the search so that the user can search immediately
+        self.search_entry.grab_focus()
         self.window.connect("delete-event", lambda *args: self.window.hide() or True)
-        status_icon.connect("activate", self.on_status_icon_clicked)
-        status_icon.connect("popup-menu", self.on_status_icon_menu)
-
-        gfile = Gio.File.new_for_path(get_notesdir())
-        self.monitor = gfile.monitor_directory(Gio.FileMonitorFlags.NONE, None)
-        if self.monitor:
-            self.monitor.connect("changed",
-                                 self.on_notes_monitor_changed,
-                                 self.list_store)
-        self.do_first_run()
 
     def do_first_run(self):
         """
         If there are no notes, create them
         and display the welcome note
         """
-        if next(iter(get_note_paths()), None) is not None:
+        self.get_note_listing_async(self.on_first_listing)
+
+    def on_first_listing(self, listing):
+        if listing:
             return
         welcome_file = get_new_note_name()
         about_file = get_new_note_name()
         touch_filename(welcome_file, tonoteencoding(DATA_WELCOME_NOTE, False))
         touch_filename(about_file, tonoteencoding(DATA_ABOUT_NOTE, False))
+        self.invalidate_note_listing()
         self.display_note_by_file(welcome_file)
 
+    def list_filter_visible(self, model, miter, data):
+        if self.search_results is None:
+            return True
+        return model.get_value(miter, 0) in self.search_results
+
+    def on_search_changed(self, entry):
+        """
+        Show only the notes matching the search,
+        and put the cursor on the best match
+        """
+        query = entry.get_text().strip()
+        if not query:
+            self.search_results = None
+            self.list_filter.refilter()
+            return
+        ## show all matches, not only the best ones
+        self.search_notes_ranked_async(
+                query, None, lambda ranked: self.show_search_results(query, ranked))
+
+    def show_search_results(self, query, ranked):
+        if self.search_entry.get_text().strip() != query:
+            ## the search changed while the index was built
+            return
+        self.search_results = set(ranked)
+        self.list_filter.refilter()
+        ## a note may not have a row yet, if it was just created
+        for filename in ranked:
+            rowiter = self.model_rows.get(filename)
+            if rowiter is not None:
+                break
+        else:
+            return
+        _valid, filter_iter = self.list_filter.convert_child_iter_to_iter(rowiter)
+        self.list_view.set_cursor(self.list_filter.get_path(filter_iter),
+                                  None, False)
+
+    def on_search_activate(self, entry):
+        path, column = self.list_view.get_cursor()
+        if path is not None:
+            self.list_view.row_activated(path, self.list_view.get_column(0))
+
     def on_list_view_row_activate(self, treeview, path, view_column):
         store = treeview.get_model()
         titer = store.get_iter(path)
@@ -1036,7 +3006,7 @@ class MainInstance (ExportedGObject):
 
     def on_status_icon_menu(self, widget, button, activate_time):
         def present_window(sender):
-            self.window.present()
+            self.present_main_window()
 
         def display_note(sender, filename):
             self.display_note_by_file(filename)
@@ -1094,29 +3064,46 @@ class MainInstance (ExportedGObject):
         else:
             self.open_note_on_screen(filename)
 
-    def delete_note(self, filepath):
+    def delete_note(self, filepath, on_result=None, on_error=None):
+        """
+        Move @filepath to the attic in the background, then
+        call @on_result(True)
+        """
         debug_log("Moving ", filepath)
-        notes_dir = get_notesdir()
-        attic_dir = os.path.join(notes_dir, DATA_ATTIC)
-        try:
-            os.makedirs(attic_dir)
-        except OSError:
-            pass
-        os.rename(filepath, os.path.join(attic_dir, os.path.basename(filepath)))
-        self.emit("note-deleted", filepath, True)
+        def moved(_result):
+            self.invalidate_note_listing()
+            self.emit("note-deleted", filepath, True)
+            if on_result is not None:
+                on_result(True)
+        self.io_pool.submit_write(move_note_to_attic, (filepath, ),
+                                  moved, on_error)
 
     def close_all(self):
         """
         Close all open windows and hidden windows
         """
+        if self.titles_write_source is not None:
+            GLib.source_remove(self.titles_write_source)
+        ## queued before the writer is shut down, so it is done below
+        self.after_note_title_updated()
+        ## this replies to D-Bus calls still in flight; the main loop
+        ## is not running anymore, so send the replies out now
+        self.io_pool.shutdown()
+        dbus.Bus().flush()
         self.metadata_service.save()
-        self.window.hide()
+        self.search_index.save()
+        self.catalog.save()
+        sync_pending_directories()
+        if self.window is not None:
+            self.window.hide()
         for filepath in list(self.open_files):
             debug_log("closing", filepath)
             self.open_files.pop(filepath).destroy()
         for preload_id in list(self.preload_ids):
             debug_log("closing", preload_id)
             self.preload_ids.pop(preload_id).destroy()
+        if self.headless:
+            return
         while Gtk.events_pending():
             Gtk.main_iteration()
         time.sleep(0.5)
@@ -1125,31 +3112,142 @@ class MainInstance (ExportedGObject):
         ## only close its window if the user deleted it
         if filepath in self.open_files and user_action:
             self.open_files.pop(filepath).destroy()
+        title = self.file_names.pop(filepath, None)
+        for deleted in self.title_reads:
+            deleted.add(filepath)
+        ## the note is forgotten here, so that the monitor reporting
+        ## a deletion made by kzrnote does not report it again
+        rowiter = self.model_rows.pop(filepath, None)
+        if rowiter is not None:
+            self.list_store.remove(rowiter)
+        self.contents_cache.invalidate(filepath)
+        self.catalog.remove(filepath)
+        self.update_search_index(filepath)
+        self.schedule_titles_write()
+        uri = self.record_change("deleted", filepath)
+        self.NoteDeleted(uri, title or "")
+
+    def on_note_created(self, sender, filepath):
+        self.update_search_index(filepath)
+        self.NoteAdded(self.record_change("created", filepath))
+
+    def on_note_contents_changed(self, sender, filepath):
+        self.update_search_index(filepath)
+        self.NoteSaved(self.record_change("changed", filepath))
 
     def on_note_title_updated(self, sender, filepath, new_title):
         if filepath in self.open_files:
             title = self.get_window_title_for_note_title(new_title)
             self.open_files[filepath].set_title(title)
-        GLib.idle_add(OnceCallback("after_note_title_updated", self.after_note_title_updated))
+        self.schedule_titles_write()
 
+    def record_change(self, kind, filepath):
+        """
+        Record a change of @kind to note @filepath, emit it as
+        NoteChanged over D-Bus and return the note's uri
+        """
+        self.change_seq += 1
+        uri = get_note_uri(filepath)
+        self.change_log.append((self.change_seq, kind, uri))
+        self.NoteChanged(self.change_seq, kind, uri)
+        return uri
+
+    def schedule_titles_write(self):
+        if self.titles_write_source is None:
+            self.titles_write_source = GLib.timeout_add(
+                    TITLES_WRITE_DELAY, self.after_note_title_updated)
+
+    @profile_span
     def after_note_title_updated(self):
-        cache = ensuredir(get_cache_dir())
-        with opennote(os.path.join(cache, CACHE_NOTETITLES), "w") as fobj:
-            for filepath in self.get_note_filenames(False):
-                title = self.ensure_note_title(filepath)
-                fobj.write("%s\n" % (title, ))
-
-    def on_notes_monitor_changed(self, monitor, gfile1, gfile2, event, model):
-        if event in (Gio.FileMonitorEvent.CREATED,
-                     Gio.FileMonitorEvent.DELETED):
-            self.model_reassess_file(model, gfile1.get_path(), addrm=True)
-        if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, ):
-            self.model_reassess_file(model, gfile1.get_path(), change=True)
+        """
+        Write out the titles of all notes, if they changed
+        since they were written last.
+
+        Nothing is written until the titles of all notes are loaded.
+        """
+        self.titles_write_source = None
+        if not self.titles_loaded:
+            return False
+        titles = sorted(set(self.file_names.values()))
+        if titles != self.written_titles:
+            def written(titles):
+                self.written_titles = titles
+            self.io_pool.submit_write(write_note_titles,
+                                      (titles, self.written_titles), written)
+        self.catalog.save(self.io_pool)
+        return False
+
+    def on_notes_monitor_changed(self, monitor, gfile1, gfile2, event):
+        self.invalidate_note_listing()
+        if event not in (Gio.FileMonitorEvent.CREATED,
+                         Gio.FileMonitorEvent.DELETED,
+                         Gio.FileMonitorEvent.CHANGES_DONE_HINT):
+            return
+        ## queue the event; repeated events for a file are merged
+        ## and it is moved last, so it ends up on top of the list
+        filename = gfile1.get_path()
+        self.pending_note_events.pop(filename, None)
+        self.pending_note_events[filename] = event
+        if self.note_events_source is None:
+            self.note_events_source = GLib.timeout_add(
+                    MONITOR_BATCH_DELAY, self.flush_note_events)
+
+    def flush_note_events(self):
+        """
+        Apply all queued notes directory events
+        """
+        self.note_events_source = None
+        ## one batch at a time, so that they are applied in order
+        if self.note_events_busy:
+            return False
+        events, self.pending_note_events = self.pending_note_events, {}
+        self.note_events_busy = True
+        filenames = [f for f in events if is_valid_note_filename(f)]
+        def probed(note_info):
+            self.note_events_busy = False
+            self.apply_note_events(events, note_info)
+            if self.pending_note_events and self.note_events_source is None:
+                self.note_events_source = GLib.idle_add(self.flush_note_events)
+        def failed(exc):
+            error("When reading notes:", exc)
+            probed({})
+        self.io_pool.submit(probe_notes, (filenames, ), probed, failed)
+        return False
+
+    @profile_span
+    def apply_note_events(self, events, note_info):
+        """
+        Apply the notes directory @events to the note model (if it
+        is built), with @note_info read by probe_notes
+        """
+        debug_log("Applying batch of %d note events" % len(events))
+        profiler.count("note_events", len(events))
+        ## until it is filled, the model is rebuilt after the events
+        model = self.list_store if self.list_store_filled else None
+        detach = len(events) > MONITOR_BATCH_DETACH and self.list_view is not None
+        if detach:
+            self.list_view.set_model(None)
+        try:
+            for filename, event in events.items():
+                probed = note_info.get(filename)
+                if probed is not None:
+                    self.contents_cache.revalidate(filename, probed[0])
+                if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+                    self.model_reassess_file(model, filename, change=True,
+                                             probed=probed)
+                else:
+                    self.model_reassess_file(model, filename, addrm=True,
+                                             probed=probed)
+        finally:
+            if detach:
+                self.list_view.set_model(self.list_filter)
 
     def on_note_opened(self, sender, filepath, window):
         window.connect("configure-event",
                        self.metadata_service.update_window_geometry,
                        filepath)
+        ## on destroy, the window does not have its geometry anymore
+        window.connect("unmap", self.metadata_service.forget_window)
         # TODO: Support notes changing font size (and thus size)?
 
     def position_window(self, window, filepath):
@@ -1183,6 +3281,7 @@ class MainInstance (ExportedGObject):
         time_ustr = time.strftime("%c")
         lcontent = tonoteencoding(NEW_NOTE_TEMPLATE % time_ustr, errors=False)
         touch_filename(note_name, lcontent)
+        self.invalidate_note_listing()
         return self.open_note_on_screen(note_name)
 
     # }}}
@@ -1209,12 +3308,8 @@ class MainInstance (ExportedGObject):
             except ValueError:
                 pass
         if not arguments:
-            if timestamp:
-                debug_log(timestamp)
-                self.window.set_startup_id(desktop_startup_id)
-                self.window.present_with_time(timestamp)
-            else:
-                self.window.present()
+            debug_log(timestamp)
+            self.present_main_window(desktop_startup_id, timestamp)
         try:
             for arg in arguments:
                 if arg == "--no-show":
@@ -1231,21 +3326,25 @@ class MainInstance (ExportedGObject):
         errmsg = self.handle_commandline(arguments, display, desktop_startup_id)
         if errmsg:
             error(errmsg)
+        self.schedule_preload()
         # stop the GLib idle_add invocation
         return False
 
     # }}}
     # Embedding VIM {{{
 
+    @profile_span
     def start_vim_hidden(self, extra_args=[], is_preload=False):
         """
         Open a new hidden Vim window
 
-        Return (window, preload_id)
-        """
-        if is_preload:
-            return (None, None)
+        Vim is started asynchronously; until its terminal is ready,
+        the window shows a placeholder.
 
+        Return the window.
+        If @is_preload, the window is added to the preload pool
+        once Vim has started.
+        """
         window = Gtk.Window()
         window.set_default_size(*guess_default_window_size())
 
@@ -1262,23 +3361,43 @@ class MainInstance (ExportedGObject):
         bg = self.config.get_color("background")
         palette = self.config.get_palette()
         terminal.set_colors(fg, bg, palette)
-        success, pid = terminal.spawn_sync(
-            Vte.PtyFlags.DEFAULT,
-            None,
-            argv,
-            None,
-            GLib.SpawnFlags.SEARCH_PATH,
-            None,
-            None,
-            None
-        )
-        if not success:
-            return None
-        terminal.connect("child-exited", self.on_vim_exit, pid, window)
+
+        placeholder = Gtk.Spinner()
+        placeholder.start()
+        stack = Gtk.Stack()
+        stack.add_named(placeholder, "placeholder")
+        stack.add_named(terminal, "terminal")
+
+        pid = None
+        cancellable = Gio.Cancellable()
+        spawn_start = time.perf_counter()
+        def spawned(terminal, spawned_pid, spawn_error, user_data):
+            nonlocal pid
+            profiler.add_span("vim_spawned", spawn_start, time.perf_counter())
+            if is_preload:
+                self.preload_pending -= 1
+            if spawn_error is not None or spawned_pid == -1:
+                error("Could not start Vim:", spawn_error)
+                if is_preload and self.preload_source is not None:
+                    GLib.source_remove(self.preload_source)
+                    self.preload_source = None
+                self.on_vim_exit(terminal, 1, -1, window)
+                return
+            pid = spawned_pid
+            debug_log("Spawned Vim", pid)
+            terminal.connect("child-exited", self.on_vim_exit, pid, window)
+            stack.set_visible_child(terminal)
+            placeholder.stop()
+            if is_preload:
+                self.preload_ids[pid] = window
 
         has_killed = False
         def window_close(window, event):
             nonlocal has_killed
+            if pid is None:
+                debug_log("Cancel spawning Vim")
+                cancellable.cancel()
+                return True
             if has_killed:
                 debug_log("Destroy window")
                 self.on_vim_exit(terminal, 1, pid, window)
@@ -1290,8 +3409,61 @@ class MainInstance (ExportedGObject):
         window.connect("delete-event", window_close)
         terminal.connect("key-press-event", self.on_terminal_key_press_event)
 
-        window.add(terminal)
-        terminal.show()
+        window.add(stack)
+        stack.show_all()
+        if is_preload:
+            self.preload_pending += 1
+        terminal.spawn_async(
+            Vte.PtyFlags.DEFAULT,
+            None,
+            argv,
+            None,
+            GLib.SpawnFlags.SEARCH_PATH,
+            None,
+            None,
+            -1,
+            cancellable,
+            spawned,
+            None
+        )
+        return window
+
+    def schedule_preload(self):
+        """
+        Fill up the pool of preloaded Vims in the background
+        """
+        if (self.preload_source is None and
+            len(self.preload_ids) < self.config.get_preload_count()):
+            self.preload_source = GLib.timeout_add(PRELOAD_DELAY,
+                                                   self.preload_vim)
+
+    def preload_vim(self):
+        """
+        Start one preloaded Vim; return True while the pool is not full
+        """
+        if (len(self.preload_ids) + self.preload_pending
+            >= self.config.get_preload_count()):
+            self.preload_source = None
+            return False
+        debug_log("Preloading Vim")
+        self.start_vim_hidden(is_preload=True)
+        return True
+
+    def take_preloaded_vim(self, filepath):
+        """
+        Take a window from the preload pool and open @filepath in it
+
+        Return the window, or None if the pool is empty.
+        """
+        if not self.preload_ids:
+            return None
+        preload_id = next(iter(self.preload_ids))
+        window = self.preload_ids.pop(preload_id)
+        debug_log("Using preloaded Vim", preload_id)
+        ## Ctrl-\ Ctrl-N goes to normal mode from any mode
+        command = ":edit %s\r" % vim_fnameescape(filepath)
+        terminal = window.get_child().get_child_by_name("terminal")
+        terminal.feed_child(b"\x1c\x0e" + os.fsencode(command))
         return window
 
     def on_spawn_child_setup(self):
@@ -1319,6 +3491,14 @@ class MainInstance (ExportedGObject):
         return False
 
     def write_vimrc_file(self):
+        """
+        Prepare the files Vim needs, once per process,
+        and return the path of the kzrnote .vim file.
+
+        The .vim file is only written if its contents differ.
+        """
+        if self.vimrc_file is not None:
+            return self.vimrc_file
         ## make sure the swp/backup dir exists at this point
         ensuredir(os.path.join(get_cache_dir(), CACHE_SWP))
         CONFIG = ensuredir(get_config_dir())
@@ -1326,8 +3506,16 @@ class MainInstance (ExportedGObject):
         ensurefile(os.path.join(CONFIG, CONFIG_USERRC))
         ## write the kzrnote .vim file
         rpath = os.path.join(CONFIG, CONFIG_VIMRC)
-        with open(rpath, "w") as runtimefobj:
-            runtimefobj.write(CONFIG_RCTEXT)
+        lcontent = tolocaleencoding(CONFIG_RCTEXT)
+        try:
+            with open(rpath, "rb") as runtimefobj:
+                old_digest = hashlib.sha1(runtimefobj.read()).digest()
+        except OSError:
+            old_digest = None
+        if old_digest != hashlib.sha1(lcontent).digest():
+            debug_log("Writing", rpath)
+            overwrite_by_rename(rpath, lcontent)
+        self.vimrc_file = rpath
         return rpath
 
     def on_vim_remote_exit(self, pid, condition, preload_argv):
@@ -1338,7 +3526,10 @@ class MainInstance (ExportedGObject):
             #GLib.timeout_add(800, self._respawn_again, preload_argv)
 
     def new_vimdow(self, name, filepath):
-        window = self.start_vim_hidden(['-c', 'e %s' % filepath])
+        window = self.take_preloaded_vim(filepath)
+        if window is None:
+            window = self.start_vim_hidden(['-c', 'e %s' % vim_fnameescape(filepath)])
+        self.schedule_preload()
         self.open_files[filepath] = window
         window.set_title(name)
         self.position_window(window, filepath)
@@ -1347,11 +3538,14 @@ class MainInstance (ExportedGObject):
 
     def on_vim_exit(self, terminal, condition, pid, window):
         debug_log( "Vim Pid: %d  exited  (%x)" % (pid, condition))
-        for k,v in list(self.open_files.items()):
-            if v == window:
-                del self.open_files[k]
-                break
-        else:
+        registered = False
+        for windows in (self.open_files, self.preload_ids):
+            for k,v in list(windows.items()):
+                if v == window:
+                    del windows[k]
+                    registered = True
+                    break
+        if not registered:
             error("Window closed but already unregistered: %d %d" % (pid, condition))
         window.destroy()
 
@@ -1379,16 +3573,30 @@ def main(argv):
     DBusGMainLoop(set_as_default=True)
     GLib.set_application_name(APPNAME)
     GLib.set_prgname(APPNAME)
+    global debug
     uargv = argv[1:]
-    if uargv and uargv[0] == '--debug':
+    profile = None
+    headless = False
+    debug = False
+    ## our own options come first, in any order; the rest
+    ## is passed on to handle_commandline
+    while uargv:
+        if uargv[0] == '--profile' or uargv[0].startswith('--profile='):
+            ## --profile or --profile=TRACEFILE
+            profile = uargv[0].partition("=")[2]
+        elif uargv[0] == '--headless':
+            headless = True
+        elif uargv[0] == '--debug':
+            debug = True
+        elif uargv[0] == '--version':
+            print(VERSION)
+            sys.exit(0)
+        else:
+            break
         uargv.pop(0)
-        global debug
-        debug = True
-    elif uargv and uargv[0] == '--version':
-        print(VERSION)
-        sys.exit(0)
-    else:
-        debug = False
+    ## the trace is only kept to be written out
+    if profile:
+        profiler.start_trace()
     desktop_startup_id = os.getenv("DESKTOP_STARTUP_ID", "")
     try:
         m = MainInstance()
@@ -1400,17 +3608,41 @@ def main(argv):
         log("An instance already running, passing on commandline...")
         return service_send_commandline(uargv, "", desktop_startup_id)
     lazy_import("uuid")
-    for gi_mod in "Gtk Gdk Gio Vte Pango".split():
+    if headless:
+        ## only the D-Bus API, with no display needed
+        gi_mods = ["Gio"]
+    else:
+        gi.require_version("Gtk", "3.0")
+        gi.require_version("Vte", "2.91")
+        gi_mods = "Gtk Gdk Gio Vte Pango".split()
+    for gi_mod in gi_mods:
         lazy_import(gi_mod, "gi.repository." + gi_mod)
-    GLib.idle_add(m.setup_basic)
-    GLib.idle_add(m.setup_gui)
-    GLib.idle_add(m.handle_commandline_main, uargv, "", desktop_startup_id)
     ensuredir(get_notesdir())
+    ## before the main loop, so that D-Bus calls can be served at once
+    m.setup_basic()
+    GLib.idle_add(m.load_note_titles)
+    if headless:
+        if uargv:
+            error("Ignoring arguments in headless mode:", " ".join(uargv))
+        m.headless = True
+        m.mainloop = GLib.MainLoop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signum,
+                                 m.mainloop.quit)
+        run = m.mainloop.run
+    else:
+        GLib.idle_add(m.setup_gui)
+        GLib.idle_add(m.handle_commandline_main, uargv, "", desktop_startup_id)
+        run = Gtk.main
     try:
-        Gtk.main()
+        run()
     finally:
         m.unregister()
         m.close_all()
+        if profile is not None:
+            profiler.write_summary(sys.stderr)
+            if profile:
+                profiler.write_trace(profile)
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv))
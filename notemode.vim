@@ -47,8 +47,10 @@ endif
 if !exists('s:cache_mtime')
     let s:have_cached_names = 0
     let s:have_cached_titles = 0
+    let s:have_cached_patterns = 0
     let s:cached_fnames = []
     let s:cached_titles = []
+    let s:cached_patterns = []
     let s:cache_mtime = 0
 endif
 
@@ -67,15 +69,36 @@ function! KaizerNotesGetTitles()
 endfunction
 
 
+function! KaizerNotesGetTitlePatterns()
+    " Get the title patterns precompiled by kzrnote, one per line,
+    " from the kzrnote cache file (empty if it does not exist)
+    if !s:have_cached_patterns
+        let patternfile = $XDG_CACHE_HOME . "/kzrnote/notetitles.patterns"
+        if filereadable(patternfile)
+            let s:cached_patterns = readfile(patternfile)
+        endif
+        let s:have_cached_patterns = 1
+    endif
+    return s:cached_patterns
+endfunction
+
 function! KaizerNotesHighlightTitles(force)
     " Highlight the names of all notes as "kaizerNoteTitle" (linked to "Underlined").
     highlight def link kaizerNoteTitle Underlined
     if a:force || !(exists('b:notes_names_last_highlighted') && b:notes_names_last_highlighted > s:cache_mtime)
-        let titles = filter(KaizerNotesGetTitles(), '!empty(v:val)')
-        call map(titles, 's:words_to_pattern(v:val)')
-        call sort(titles, 's:sort_longest_to_shortest')
         syntax clear kaizerNoteTitle
-        execute 'syntax match kaizerNoteTitle /\c\%>2l\%(' . escape(join(titles, '\|'), '/') . '\)/'
+        let patterns = filter(copy(KaizerNotesGetTitlePatterns()), '!empty(v:val)')
+        if !empty(patterns)
+            " already escaped, and longest titles matching first
+            for pattern in patterns
+                execute 'syntax match kaizerNoteTitle /\c\%>2l\%(' . pattern . '\)/'
+            endfor
+        else
+            let titles = filter(KaizerNotesGetTitles(), '!empty(v:val)')
+            call map(titles, 's:words_to_pattern(v:val)')
+            call sort(titles, 's:sort_longest_to_shortest')
+            execute 'syntax match kaizerNoteTitle /\c\%>2l\%(' . escape(join(titles, '\|'), '/') . '\)/'
+        endif
         let b:notes_names_last_highlighted = localtime()
     endif
 endfunction